@@ -7,12 +7,16 @@ input build manifest
 """
 
 import argparse
+import concurrent.futures
 import contextlib
+import fcntl
 import gzip
+import hashlib
 import json
 import os
 import os.path
 import pathlib
+import re
 import shutil
 import subprocess
 import sys
@@ -25,6 +29,8 @@ from pathlib import Path
 from subprocess import PIPE, STDOUT
 from typing import Union
 
+from tarball_cache import TarballCache
+
 
 # Context manager for handling a given set of code/commands
 # being run from a given directory on the filesystem
@@ -49,6 +55,110 @@ def Popen(cmd, **kwargs):
     print("++", *cmd)
     return subprocess.Popen(cmd, **kwargs)
 
+# Append compressed data to an open file, by writing through a
+# compressor, so an archive can be streamed straight into its
+# compressed form. Each use appends one gzip member or zstd frame; both
+# formats allow these to be concatenated. gzip output comes from pigz,
+# using all cores, if it's installed (Python's gzip module otherwise);
+# zstd output requires the zstd command
+@contextlib.contextmanager
+def compressed_writer(out_fh, compression='gzip'):
+    threads = str(os.cpu_count() or 1)
+
+    if compression == 'zstd':
+        cmd = ['zstd', '-q', f'-T{threads}', '-c']
+    elif compression == 'gzip':
+        if shutil.which('pigz') is None:
+            # No file name or timestamp in the header, so the same
+            # input always gives the same output
+            with gzip.GzipFile(filename='', fileobj=out_fh, mode='wb',
+                               mtime=0) as fh:
+                yield fh
+            return
+        cmd = ['pigz', '-9', '-n', '-p', threads, '-c']
+    else:
+        print(f'\n\nError: unknown compression "{compression}"!')
+        sys.exit(6)
+
+    if shutil.which(cmd[0]) is None:
+        print(f'\n\nError: {cmd[0]} is required for {compression} compression!')
+        sys.exit(6)
+
+    # Anything already buffered must land before the compressor's output
+    out_fh.flush()
+    proc = Popen(cmd, stdin=PIPE, stdout=out_fh)
+    try:
+        yield proc.stdin
+    finally:
+        proc.stdin.close()
+        rc = proc.wait()
+
+    if rc != 0:
+        print(f'\n\nError {rc} running {cmd[0]}!')
+        sys.exit(6)
+
+# The end-of-archive marker: two empty blocks
+TAR_EOF = tarfile.NUL * tarfile.BLOCKSIZE * 2
+
+class _Position:
+    """
+    Write-only file wrapper keeping track of the position, so tarfile
+    can write to pipes, and optionally updating a hash object with
+    everything written
+    """
+
+    def __init__(self, fileobj, digest=None):
+        self.fileobj = fileobj
+        self.digest = digest
+        self.position = 0
+
+    def write(self, data):
+        self.fileobj.write(data)
+        if self.digest is not None:
+            self.digest.update(data)
+        self.position += len(data)
+
+    def tell(self):
+        return self.position
+
+# Open a tar archive which only writes entries. Closing a TarFile would
+# add the end-of-archive marker, so these are never closed, and what
+# they write can be concatenated into one archive ending in TAR_EOF.
+# If given, digest is a hash object updated with the tar data
+def tar_fragment(fileobj, digest=None):
+    return tarfile.TarFile(fileobj=_Position(fileobj, digest), mode='w')
+
+# Total size of the pack files in the object stores repo keeps under a
+# checkout's .repo directory: roughly what syncing it has fetched, found
+# without walking the working trees or any loose objects
+def pack_size(top):
+    total = 0
+    for root, dirs, files in os.walk(
+            os.path.join(top, '.repo', 'project-objects')):
+        if root.endswith('.git'):
+            dirs[:] = []
+            with contextlib.suppress(OSError):
+                for entry in os.scandir(os.path.join(root, 'objects', 'pack')):
+                    if entry.name.endswith('.pack'):
+                        total += entry.stat().st_size
+    return total
+
+# Total size of whichever of the given files exist
+def file_size(*paths):
+    return sum(
+        os.path.getsize(path) for path in paths if os.path.isfile(path)
+    )
+
+# tarfile filter giving every entry the same owner and modification
+# time, for reproducible archives
+def normalize_tarinfo(mtime):
+    def normalize(tarinfo):
+        tarinfo.uid = tarinfo.gid = 0
+        tarinfo.uname = tarinfo.gname = ''
+        tarinfo.mtime = mtime
+        return tarinfo
+    return normalize
+
 # Save current path for program
 script_dir = os.path.dirname(os.path.realpath(__file__))
 
@@ -63,9 +173,11 @@ class ManifestBuilder:
     output_filenames = [
         'build.properties',
         'build-properties.json',
+        'build-timings.json',
         'build-manifest.xml',
         'source.tar',
         'source.tar.gz',
+        'source.tar.zst',
         'CHANGELOG'
     ]
 
@@ -81,6 +193,14 @@ class ManifestBuilder:
         self.build_manifests_org = args.build_manifests_org
         self.force = args.force
         self.push = not args.no_push
+        self.incremental_sync = args.incremental_sync
+        self.repo_mirror = None
+        if args.repo_mirror is not None:
+            self.repo_mirror = pathlib.Path(args.repo_mirror).resolve()
+        self.tarball_cache = None
+        if args.tarball_cache is not None:
+            self.tarball_cache = TarballCache(
+                args.tarball_cache, args.tarball_cache_size * 1024 ** 3)
 
         self.output_files = dict()
         self.product = None
@@ -104,7 +224,52 @@ class ManifestBuilder:
         self.release = None
         self.last_build_num = 0
         self.build_num = None
+        self.source_digest = None
         self.util_dir = pathlib.Path(__file__).parent.parent / "utilities"
+        self.timings = dict()
+
+    @contextlib.contextmanager
+    def phase(self, name, measure=None):
+        """
+        Record the wall-clock time taken by the enclosed code, plus the
+        number of bytes it dealt with as returned by measure() when it
+        finishes (successfully or not). measure() isn't timed, and
+        should be cheap
+        """
+
+        start = time.time()
+        try:
+            yield
+        finally:
+            elapsed = round(time.time() - start, 3)
+            size = None
+            if measure is not None:
+                with contextlib.suppress(OSError, TypeError):
+                    size = measure()
+            self.timings[name] = {
+                'wall': elapsed,
+                'bytes': size,
+            }
+
+    def write_timings(self, start):
+        """
+        Write the phase timings to build-timings.json
+        """
+
+        timings_file = self.output_files.get('build-timings.json')
+        if timings_file is None:
+            return
+
+        with open(timings_file, 'w') as fh:
+            json.dump({
+                'PRODUCT': self.product,
+                'RELEASE': self.release,
+                'VERSION': self.version,
+                'BLD_NUM': self.build_num,
+                'MANIFEST': str(self.manifest),
+                'total_wall': round(time.time() - start, 3),
+                'phases': self.timings,
+            }, fh, indent=2, separators=(',', ': '))
 
     def prepare_files(self):
         """
@@ -292,9 +457,147 @@ class ManifestBuilder:
         # Release may be omitted, will default to VERSION
         self.release = self.manifest_config.get('release', self.version)
 
+    @contextlib.contextmanager
+    def repo_mirror_reference(self, top_dir):
+        """
+        Bring the shared repo mirror up to date with the input manifest
+        and yield its path to pass as --reference, or None if there is
+        no mirror or it couldn't be updated. The mirror is locked
+        exclusively while it's updated, and then shared until the
+        caller is finished with it
+        """
+
+        if self.repo_mirror is None:
+            yield None
+            return
+
+        self.repo_mirror.mkdir(parents=True, exist_ok=True)
+        with open(self.repo_mirror / '.lock', 'w') as lock_fh:
+            fcntl.flock(lock_fh, fcntl.LOCK_EX)
+            reference = self.repo_mirror
+
+            with pushd(self.repo_mirror):
+                try:
+                    run([
+                        'repo', 'init', '-u', str(top_dir / 'manifest'),
+                        '-g', 'all', '-m', str(self.manifest), '--mirror'
+                    ], check=True)
+                    run(['repo', 'sync', '--jobs=6'], check=True)
+                except subprocess.CalledProcessError as exc:
+                    print(f'Updating repo mirror failed ({exc}), syncing '
+                          'without it')
+                    reference = None
+
+            fcntl.flock(lock_fh, fcntl.LOCK_SH)
+            yield reference
+
+    def repo_init(self, top_dir, reference):
+        """
+        Initialize (or re-initialize) the repo sync in the current
+        directory from the input manifest
+        """
+
+        repo_init = [
+            'repo', 'init', '-u', str(top_dir / 'manifest'),
+            '-g', 'all', '-m', str(self.manifest)
+        ]
+
+        if reference is not None:
+            repo_init += [f'--reference={reference}']
+
+        # Another workaround for a git repository with a branch name
+        # containing an illegal utf-8 character - the --depth option
+        # prevents repo from trying to sync all branches (CBD-6118).
+        # Since we know we aren't going create a source tarball anyway,
+        # might as well save some time and use --depth=1.
+        if str(self.manifest).startswith('model-serving-agent'):
+            repo_init += ['--depth', '1']
+
+        run(repo_init, check=True)
+
+    def clean_repo_sync(self, top_dir, reference):
+        """
+        Sync from scratch, other than the .repo directory
+        """
+
+        # Clean out all files and directories in the top-level other
+        # than the .repo directory, to ensure the repo sync is
+        # clean. Also remove `.repo/manifests`, to force it to sync
+        # the local `manifest` directory fresh. This works around an
+        # esoteric problem with local git clones and `--depth 1`
+        # below.
+        top_level = [
+            f for f in pathlib.Path().iterdir() if str(f) != '.repo'
+        ]
+        manifests_dirs = [
+            pathlib.Path('.repo/manifests'),
+            pathlib.Path('.repo/manifests.git'),
+        ]
+        top_level += [ x for x in manifests_dirs if x.exists() ]
+
+        child: Union[str, Path]
+        for child in top_level:
+            if child.is_file() or child.is_symlink():
+                child.unlink()
+            elif child.is_dir():
+                shutil.rmtree(child)
+            else:
+                print("\n\nError: {str(child)} is not a regular file, directory, or symlink!")
+                sys.exit(5)
+
+        # Silly work-around for git bug - sometimes you just need
+        # to run "git status" in a directory to fix "something"
+        if os.path.exists(".repo/repo"):
+            with pushd(".repo/repo"):
+                run(['git', 'status'], check=True, stdout=PIPE)
+
+        self.repo_init(top_dir, reference)
+        run(['repo', 'sync', '--jobs=6', '--force-sync'], check=True)
+
+    def refresh_repo_sync(self, top_dir, reference):
+        """
+        Bring an existing repo sync up to date in place: discard any
+        local changes and untracked files in the projects, sync with
+        detached heads, then remove anything at the top level which
+        the manifest no longer accounts for
+        """
+
+        self.repo_init(top_dir, reference)
+        run([
+            'repo', 'forall', '-c',
+            'git reset --quiet --hard HEAD && git clean --quiet -fdx'
+        ], check=True)
+        run(['repo', 'sync', '--jobs=6', '--force-sync', '-d'], check=True)
+
+        # Top-level entries are project directories (or their parents)
+        # and copyfile/linkfile destinations
+        manifest = EleTree.fromstring(
+            run(['repo', 'manifest'], check=True, stdout=PIPE).stdout
+        )
+        keep = {'.repo'}
+        for project in manifest.iterfind('project'):
+            keep.add(
+                pathlib.Path(project.get('path', project.get('name'))).parts[0]
+            )
+            for copy in project.iterfind('copyfile'):
+                keep.add(pathlib.Path(copy.get('dest')).parts[0])
+            for link in project.iterfind('linkfile'):
+                keep.add(pathlib.Path(link.get('dest')).parts[0])
+
+        for child in pathlib.Path().iterdir():
+            if child.name in keep:
+                continue
+            print(f'Removing {child}')
+            if child.is_dir() and not child.is_symlink():
+                shutil.rmtree(child)
+            else:
+                child.unlink()
+
     def perform_repo_sync(self):
         """
-        Perform a repo sync based on the input manifest
+        Perform a repo sync based on the input manifest. With
+        --incremental-sync, an existing sync is refreshed in place,
+        falling back to syncing from scratch if that fails
         """
 
         product_dir = pathlib.Path(self.product_path)
@@ -303,53 +606,27 @@ class ManifestBuilder:
         if not product_dir.is_dir():
             product_dir.mkdir(parents=True)
 
-        with pushd(product_dir):
-            # Clean out all files and directories in the top-level other
-            # than the .repo directory, to ensure the repo sync is
-            # clean. Also remove `.repo/manifests`, to force it to sync
-            # the local `manifest` directory fresh. This works around an
-            # esoteric problem with local git clones and `--depth 1`
-            # below.
-            top_level = [
-                f for f in pathlib.Path().iterdir() if str(f) != '.repo'
-            ]
-            manifests_dirs = [
-                pathlib.Path('.repo/manifests'),
-                pathlib.Path('.repo/manifests.git'),
-            ]
-            top_level += [ x for x in manifests_dirs if x.exists() ]
-
-            child: Union[str, Path]
-            for child in top_level:
-                if child.is_file() or child.is_symlink():
-                    child.unlink()
-                elif child.is_dir():
-                    shutil.rmtree(child)
-                else:
-                    print("\n\nError: {str(child)} is not a regular file, directory, or symlink!")
-                    sys.exit(5)
-
-            # Silly work-around for git bug - sometimes you just need
-            # to run "git status" in a directory to fix "something"
-            if os.path.exists(".repo/repo"):
-                with pushd(".repo/repo"):
-                    run(['git', 'status'], check=True, stdout=PIPE)
-
-            repo_init = [
-                'repo', 'init', '-u', str(top_dir / 'manifest'),
-                '-g', 'all', '-m', str(self.manifest)
-            ]
-
-            # Another workaround for a git repository with a branch name
-            # containing an illegal utf-8 character - the --depth option
-            # prevents repo from trying to sync all branches (CBD-6118).
-            # Since we know we aren't going create a source tarball anyway,
-            # might as well save some time and use --depth=1.
-            if str(self.manifest).startswith('model-serving-agent'):
-                repo_init += ['--depth', '1']
-
-            run(repo_init, check=True)
-            run(['repo', 'sync', '--jobs=6', '--force-sync'], check=True)
+        with self.repo_mirror_reference(top_dir) as reference, \
+                pushd(product_dir):
+            start = time.time()
+            refreshed = False
+
+            if (self.incremental_sync
+                    and pathlib.Path('.repo/manifest.xml').exists()
+                    and not str(self.manifest).startswith('model-serving-agent')):
+                try:
+                    self.refresh_repo_sync(top_dir, reference)
+                    refreshed = True
+                except subprocess.CalledProcessError as exc:
+                    print(f'Refreshing existing repo sync failed ({exc}), '
+                          'syncing from scratch')
+
+            if not refreshed:
+                self.clean_repo_sync(top_dir, reference)
+
+            print(f"Repo sync ({'refreshed' if refreshed else 'from scratch'}"
+                  f"{', with mirror' if reference else ''}) took "
+                  f'{time.time() - start:.1f}s')
 
     def update_bm_repo_and_get_build_num(self):
         """
@@ -382,6 +659,179 @@ class ManifestBuilder:
 
             self.build_num = max(self.last_build_num + 1, self.start_build)
 
+    def exit_unchanged(self):
+        """
+        Announce that there have been no changes since the previous
+        build, create empty properties files and exit
+        """
+
+        print('*\n*\n*\n***** No changes since '
+              f'{self.product} {self.release} '
+              f'build {self.version}-{self.last_build_num};'
+              ' not executing new build *****\n*\n*\n*\n')
+        json_file = self.output_files['build-properties.json']
+        prop_file = self.output_files['build.properties']
+
+        with open(json_file, "w") as fh:
+            json.dump({}, fh)
+
+        with open(prop_file, "w") as fh:
+            fh.write('')
+
+        sys.exit(0)
+
+    def remote_projects(self):
+        """
+        Determine the repository URL and ref (or commit) of each project
+        in the input manifest, as a dict of path -> (url, ref). Returns
+        None if the manifest uses anything this doesn't understand, in
+        which case only a repo sync can tell what it refers to
+        """
+
+        input_manifest = EleTree.parse(pathlib.Path('manifest') / self.manifest)
+        root = input_manifest.getroot()
+
+        # Nested projects take their path (and possibly their remote and
+        # revision) from their parent, so are left to repo too
+        if root.find('include') is not None \
+                or root.find('extend-project') is not None \
+                or root.find('remove-project') is not None \
+                or root.find('project/project') is not None:
+            return None
+
+        remotes = {
+            remote.get('name'): remote for remote in root.iterfind('remote')
+        }
+        default = root.find('default')
+        if default is None:
+            default = EleTree.Element('default')
+
+        projects = {}
+        for project in root.iterfind('project'):
+            remote = remotes.get(project.get('remote', default.get('remote')))
+            if remote is None:
+                return None
+
+            # Relative fetch URLs are resolved against the manifest
+            # repository's URL by repo; don't try to second-guess that
+            fetch = remote.get('fetch', '')
+            if '://' not in fetch and not fetch.startswith('git@'):
+                return None
+
+            revision = project.get('revision') or remote.get('revision') \
+                or default.get('revision')
+            if revision is None:
+                return None
+            if not re.fullmatch('[0-9a-f]{40}', revision) \
+                    and not revision.startswith('refs/'):
+                revision = f'refs/heads/{revision}'
+
+            path = project.get('path', project.get('name'))
+            projects[path] = (
+                f"{fetch.rstrip('/')}/{project.get('name')}", revision
+            )
+
+        return projects
+
+    def remote_unchanged(self):
+        """
+        Check, without syncing, whether any project has moved since the
+        previous build, by resolving each project's ref with
+        'git ls-remote' (one call per repository, run in parallel) and
+        comparing with the revisions in the last build manifest. Any
+        doubt is treated as a change, leaving the decision to
+        check_for_changes() after a full sync
+        """
+
+        if not self.build_manifest_filename.exists():
+            return False
+
+        projects = self.remote_projects()
+        if projects is None:
+            print('Input manifest not suitable for checking remote refs')
+            return False
+
+        last_manifest = EleTree.parse(self.build_manifest_filename)
+        if last_manifest.find('project/project') is not None:
+            print('Last build manifest has nested projects')
+            return False
+        last_revisions = {
+            project.get('path', project.get('name')): project.get('revision')
+            for project in last_manifest.iterfind('project')
+        }
+        if set(projects) != set(last_revisions):
+            print('Projects added or removed since last build')
+            return False
+
+        # Changes in these projects don't trigger a build, as in
+        # manifest-unchanged
+        ignore_projects = {
+            'testrunner',
+            'product-metadata',
+            'product-texts',
+            'golang',
+            'mobile-testkit',
+        }
+        ignore_projects.update(self.manifest_config.get('ignore_projects', []))
+
+        # Tags are also asked for peeled, as an annotated tag's commit is
+        # only listed when asked for by name
+        refs_by_url = {}
+        for url, ref in projects.values():
+            if not re.fullmatch('[0-9a-f]{40}', ref):
+                refs_by_url.setdefault(url, set()).add(ref)
+                if ref.startswith('refs/tags/'):
+                    refs_by_url[url].add(f'{ref}^{{}}')
+
+        def ls_remote(url):
+            cmd = ['git', 'ls-remote', url] + sorted(refs_by_url[url])
+            # A single print, so output from the threads doesn't mix
+            print(f"++ {' '.join(cmd)}")
+            result = subprocess.run(
+                cmd, stdout=PIPE, stderr=STDOUT, timeout=300,
+                env=dict(os.environ, GIT_TERMINAL_PROMPT='0')
+            )
+            if result.returncode != 0:
+                print(result.stdout.decode('utf-8', errors='replace'))
+                return None
+
+            # An annotated tag's commit takes precedence over the tag
+            heads = {}
+            for line in result.stdout.decode('utf-8').splitlines():
+                sha, ref = line.split('\t')
+                if ref.endswith('^{}'):
+                    heads[ref[:-3]] = sha
+                else:
+                    heads.setdefault(ref, sha)
+            return heads
+
+        try:
+            with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=16) as executor:
+                heads = dict(zip(refs_by_url,
+                                 executor.map(ls_remote, refs_by_url)))
+        except subprocess.TimeoutExpired:
+            print('Timed out checking remote refs')
+            return False
+
+        for path, (url, ref) in sorted(projects.items()):
+            if path in ignore_projects:
+                continue
+            if re.fullmatch('[0-9a-f]{40}', ref):
+                current = ref
+            elif heads[url] is None:
+                print(f'Could not check {url}')
+                return False
+            else:
+                current = heads[url].get(ref)
+
+            if current != last_revisions[path]:
+                print(f'{path} has changed since last build '
+                      f'({last_revisions[path]} -> {current})')
+                return False
+
+        return True
+
     def check_for_changes(self):
         """
         Check if there have been changes since the previous build.
@@ -402,20 +852,7 @@ class ManifestBuilder:
             ])
             if chk_result.returncode == 0:
                 if not self.force:
-                    print('*\n*\n*\n***** No changes since '
-                          f'{self.product} {self.release} '
-                          f'build {self.version}-{self.last_build_num};'
-                          ' not executing new build *****\n*\n*\n*\n')
-                    json_file = self.output_files['build-properties.json']
-                    prop_file = self.output_files['build.properties']
-
-                    with open(json_file, "w") as fh:
-                        json.dump({}, fh)
-
-                    with open(prop_file, "w") as fh:
-                        fh.write('')
-
-                    sys.exit(0)
+                    self.exit_unchanged()
                 else:
                     print('No changes since last build but forcing new '
                           'build anyway')
@@ -525,7 +962,8 @@ class ManifestBuilder:
             'BUILD_JOB': self.build_job,
             'PLATFORMS': self.platforms,
             'GO_VERSION': self.go_version,
-            'FORCE': self.force
+            'FORCE': self.force,
+            'SOURCE_SHA256': self.source_digest
         }
         # Append job parameters from product-config.json
         properties.update(self.build_job_parameters)
@@ -540,6 +978,138 @@ class ManifestBuilder:
                 else:
                     fh.write(f'{key}={value}\n')
 
+    def cacheable_projects(self):
+        """
+        Return the projects in the new build manifest which have been
+        synced to a specific commit, as a dict of path -> revision.
+        Projects with nested projects are left out, as their trees
+        depend on more than their own revision
+        """
+
+        projects = {}
+        build_manifest = EleTree.parse(self.build_manifest_filename)
+
+        for project in build_manifest.iterfind('project'):
+            path = os.path.normpath(project.get('path', project.get('name')))
+            revision = project.get('revision', '')
+
+            if (re.fullmatch('[0-9a-f]{40}', revision)
+                    and project.find('project') is None
+                    and (pathlib.Path(self.product_path) / path).is_dir()):
+                projects[path] = revision
+
+        return projects
+
+    @classmethod
+    def add_tree(cls, tar_fh, top, exclude=(), filter=None, keep_git=False):
+        """
+        Add a directory tree to a tar file in sorted order, leaving out
+        .repo directories and any paths in exclude, plus .git
+        directories unless keep_git is set. filter is passed on to
+        TarFile.add()
+        """
+
+        if top != '.':
+            tar_fh.add(top, recursive=False, filter=filter)
+
+        # Git files already added, for add_git_dir()
+        git_files = {}
+
+        for root, dirs, files in os.walk(top):
+            for name in sorted(files):
+                path = os.path.normpath(os.path.join(root, name))
+                if path not in exclude:
+                    tar_fh.add(path, filter=filter)
+            dirs.sort()
+            for name in list(dirs):
+                path = os.path.normpath(os.path.join(root, name))
+                if name == '.git' and keep_git:
+                    cls.add_git_dir(tar_fh, path, git_files, filter)
+                if name == '.repo' or name == '.git' or path in exclude:
+                    dirs.remove(name)
+                else:
+                    tar_fh.add(path, recursive=False, filter=filter)
+
+    @staticmethod
+    def git_file_identity(path):
+        """
+        Return something identifying a git file's contents: the file
+        itself, or for a pack or pack index, its size and the checksum
+        git stores at the end of it, so copies of the same pack in
+        different projects are recognized too
+        """
+
+        st = os.stat(path)
+        if os.path.basename(os.path.dirname(path)) == 'pack' \
+                and path.endswith(('.pack', '.idx')) and st.st_size >= 20:
+            with open(path, 'rb') as fh:
+                fh.seek(-20, os.SEEK_END)
+                return ('pack', os.path.basename(path), st.st_size, fh.read())
+        return (st.st_dev, st.st_ino)
+
+    @classmethod
+    def add_git_dir(cls, tar_fh, git_dir, git_files, filter=None):
+        """
+        Add a project's .git directory to a tar file. Symlinks are
+        dereferenced so that the resulting .git directories work on
+        Windows; for the same reason, the .repo directory isn't
+        saved, as that would double the size of the tarball since it
+        mostly just contains git dirs. A file whose contents have
+        already been added (often the case for pack files, as repo
+        shares objects between checkouts of the same repository) is
+        added as a hard link to the earlier entry. git_files maps file
+        identities to entry names, and is updated
+        """
+
+        dereference = tar_fh.dereference
+        tar_fh.dereference = True
+        try:
+            tar_fh.add(git_dir, recursive=False, filter=filter)
+            for root, dirs, files in os.walk(git_dir, followlinks=True):
+                dirs.sort()
+                for name in dirs:
+                    tar_fh.add(os.path.join(root, name), recursive=False,
+                               filter=filter)
+
+                for name in sorted(files):
+                    path = os.path.join(root, name)
+                    # Git (or repo) sometimes creates broken symlinks,
+                    # like "shallow", and Python's tarfile module chokes
+                    # on those
+                    if not os.path.exists(path):
+                        continue
+
+                    tarinfo = tar_fh.gettarinfo(path)
+                    identity = cls.git_file_identity(path)
+                    if identity in git_files:
+                        tarinfo.type = tarfile.LNKTYPE
+                        tarinfo.linkname = git_files[identity]
+                        tarinfo.size = 0
+                    else:
+                        git_files[identity] = tarinfo.name
+
+                    if filter is not None:
+                        tarinfo = filter(tarinfo)
+                    if tarinfo.isreg():
+                        with open(path, 'rb') as fh:
+                            tar_fh.addfile(tarinfo, fh)
+                    else:
+                        tar_fh.addfile(tarinfo)
+        finally:
+            tar_fh.dereference = dereference
+
+    def source_date(self):
+        """
+        Return the time of the last commit to the input manifest, used
+        as the modification time of everything in a reproducible
+        source tarball
+        """
+
+        return int(run(
+            ['git', 'log', '-1', '--format=%ct', '--', str(self.manifest)],
+            cwd='manifest', check=True, stdout=PIPE
+        ).stdout.decode('utf-8').strip())
+
     def create_tarball(self):
         """
         Create the source tarball from the repo sync and generated
@@ -552,56 +1122,153 @@ class ManifestBuilder:
             print(f'Skipping creation of source.tar.gz')
             return
 
-        tarball_filename = self.output_files['source.tar']
-        targz_filename = self.output_files['source.tar.gz']
+        # gzip unless the manifest asks for zstd (source.tar.zst),
+        # which only suits consumers which know to expect it
+        compression = self.manifest_config.get(
+            'source_tarball_compression', 'gzip')
+        if compression == 'zstd':
+            tarball_filename = self.output_files['source.tar.zst']
+        else:
+            tarball_filename = self.output_files['source.tar.gz']
 
         print(f'Creating {tarball_filename}')
         product_dir = pathlib.Path(self.product_path)
+        keep_git = self.manifest_config.get('keep_git', False)
+
+        # Entries are always added in sorted order. A reproducible
+        # tarball also gives every entry a fixed owner and the time of
+        # the manifest commit, so the same sources always give the same
+        # tar data
+        reproducible = self.manifest_config.get(
+            'reproducible_source_tarball', False)
+        source_date = None
+        normalize = None
+        if reproducible:
+            source_date = self.source_date()
+            normalize = normalize_tarinfo(source_date)
+
+        # Each project synced to a known revision is archived after
+        # everything outside the projects, in order of path, so the
+        # entries come in the same order whether or not the projects
+        # come from the cache. Project .git directories change even
+        # when the revision doesn't, so tarballs which keep them are
+        # archived in one pass instead
+        projects = {}
+        if not keep_git:
+            projects = self.cacheable_projects()
+
+        # The build manifest differs on every build, so it goes at the
+        # end, outside the source digest
+        exclude = set(projects) | {'manifest.xml'}
+        digests = {}
+
+        # The tar stream goes straight into the compressor, rather than
+        # via an uncompressed source.tar. With a cache, every project is
+        # a separate gzip member or zstd frame which can be copied into
+        # later tarballs, so only the uncompressed tar data is the same
+        # as without one
+        with pushd(product_dir), open(tarball_filename, 'wb') as out_fh:
+            with compressed_writer(out_fh, compression) as comp_fh:
+                if keep_git:
+                    print(f'Including Git files in {tarball_filename}')
+                digests['.'] = self.add_tree_digest(
+                    comp_fh, '.', exclude, normalize, keep_git)
+
+                if self.tarball_cache is None:
+                    for path in sorted(projects):
+                        digests[path] = self.add_tree_digest(
+                            comp_fh, path, self.nested_projects(projects, path),
+                            normalize)
+                    self.add_build_manifest(comp_fh, normalize)
+
+            if self.tarball_cache is not None:
+                reused = 0
+                for path, revision in sorted(projects.items()):
+                    key = self.tarball_cache.key(
+                        compression, path, revision, source_date)
+                    cached = self.tarball_cache.get(key)
+
+                    nested = self.nested_projects(projects, path)
+                    if cached is None:
+                        with self.tarball_cache.put(key) as (frag_fh, sha256), \
+                                compressed_writer(frag_fh, compression) as comp_fh:
+                            self.add_tree(tar_fragment(comp_fh, sha256), path,
+                                          nested, normalize)
+                        cached = self.tarball_cache.get(key)
+                    else:
+                        reused += 1
+
+                    if cached is None:
+                        # Evicted by another build sharing the cache as
+                        # soon as it was added, so archive it again here
+                        with compressed_writer(out_fh, compression) as comp_fh:
+                            digests[path] = self.add_tree_digest(
+                                comp_fh, path, nested, normalize)
+                        continue
+
+                    digests[path], frag_fh = cached
+                    with frag_fh:
+                        shutil.copyfileobj(frag_fh, out_fh)
+
+                with compressed_writer(out_fh, compression) as comp_fh:
+                    self.add_build_manifest(comp_fh, normalize)
+
+                print(f'Reused {reused} of {len(projects)} projects from '
+                      f'{self.tarball_cache.cache_dir}')
+
+        if self.tarball_cache is not None:
+            self.tarball_cache.evict()
+
+        # Only a reproducible tarball's contents can be compared between
+        # builds. The digest covers the uncompressed tar data of
+        # everything but the build manifest, so it doesn't depend on
+        # the build number, the compression or the cache
+        if reproducible:
+            self.source_digest = self.combined_digest(digests)
+            print(f'Source SHA-256: {self.source_digest}')
+
+    @staticmethod
+    def nested_projects(projects, path):
+        """
+        Return the projects checked out inside the given project
+        """
+
+        return {p for p in projects if p.startswith(f'{path}/')}
 
-        with pushd(product_dir):
-            with tarfile.open(tarball_filename, 'w') as tar_fh:
-                for root, dirs, files in os.walk('.'):
-                    for name in files:
-                        tar_fh.add(os.path.join(root, name)[2:])
-                    for name in dirs:
-                        if name == '.repo' or name == '.git':
-                            dirs.remove(name)
-                        else:
-                            tar_fh.add(os.path.join(root, name)[2:],
-                                       recursive=False)
-
-            if self.manifest_config.get('keep_git', False):
-                print(f'Adding Git files to {tarball_filename}')
-                # When keeping git files, need to dereference symlinks
-                # so that the resulting .git directories work on Windows.
-                # Because of this, we don't save the .repo directory
-                # also, as that would double the size of the tarball
-                # since mostly .repo just contains git dirs.
-                with tarfile.open(tarball_filename, "a",
-                                  dereference=True) as tar:
-                    for root, dirs, files in os.walk('.', followlinks=True):
-                        for name in dirs:
-                            if name == '.repo':
-                                dirs.remove(name)
-                            elif name == '.git':
-                                tar.add(os.path.join(root, name)[2:],
-                                        recursive=False)
-                        if '/.git' in root:
-                            for name in files:
-                                # Git (or repo) sometimes creates broken
-                                # symlinks, like "shallow", and Python's
-                                # tarfile module chokes on those
-                                if os.path.exists(os.path.join(root, name)):
-                                    tar.add(os.path.join(root, name)[2:],
-                                            recursive=False)
-
-        print(f'Compressing {tarball_filename}')
-
-        with open(tarball_filename, 'rb') as f_in, \
-                gzip.open(targz_filename, 'wb') as f_out:
-            shutil.copyfileobj(f_in, f_out)
-
-        os.unlink(tarball_filename)
+    def add_tree_digest(self, comp_fh, top, exclude=(), filter=None,
+                        keep_git=False):
+        """
+        Add a directory tree to the tar stream being written to comp_fh
+        (see add_tree()), returning the SHA-256 of the tar data
+        """
+
+        sha256 = hashlib.sha256()
+        self.add_tree(tar_fragment(comp_fh, sha256), top, exclude, filter,
+                      keep_git)
+        return sha256.hexdigest()
+
+    @staticmethod
+    def add_build_manifest(comp_fh, filter=None):
+        """
+        Finish the tar stream being written to comp_fh with the build
+        manifest and the end-of-archive marker
+        """
+
+        if os.path.exists('manifest.xml'):
+            tar_fragment(comp_fh).add('manifest.xml', filter=filter)
+        comp_fh.write(TAR_EOF)
+
+    @staticmethod
+    def combined_digest(digests):
+        """
+        Combine the SHA-256 of each part of the tarball (everything
+        outside the projects, '.', and each project) into one
+        """
+
+        sha256 = hashlib.sha256()
+        for path, digest in sorted(digests.items()):
+            sha256.update(f'{path} {digest}\n'.encode())
+        return sha256.hexdigest()
 
     def generate_final_files(self):
         """
@@ -612,8 +1279,14 @@ class ManifestBuilder:
         """
 
         self.copy_build_manifest()
+
+        # The properties include the tarball's digest
+        with self.phase('create_tarball', lambda: file_size(
+                self.output_files['source.tar.gz'],
+                self.output_files['source.tar.zst'])):
+            self.create_tarball()
+
         self.create_properties_files()
-        self.create_tarball()
 
     def create_manifest(self):
         """
@@ -626,35 +1299,67 @@ class ManifestBuilder:
             from it
           - If there are submodules, ensure they're updated
           - Set the relevant and necessary paramaters (e.g. version)
-          - Do a repo sync based on the given manifest
           - Update the build-manifests repository and determine
             the next build number to use
+          - Stop early if the remote repositories show no changes
+            since the last build
+          - Do a repo sync based on the given manifest
           - Generate the CHANGELOG and update the build manifest
             annotations
           - Push the generated manifest to build-manifests, if
             pushing is requested
           - Generate the new build manifest, properties files, and
             source tarball
+          - Write the time taken by each step to build-timings.json
         """
 
+        start = time.time()
         self.prepare_files()
-        self.do_manifest_stuff()
 
-        module_projects = self.manifest_config.get('module_projects')
-        if module_projects is not None:
-            self.update_submodules(module_projects)
-
-        self.set_relevant_parameters()
-        self.set_build_parameters()
-        self.perform_repo_sync()
-        self.update_bm_repo_and_get_build_num()
-
-        with pushd(self.product_path):
-            self.check_for_changes()
-            commit_msg = self.update_build_manifest_annotations()
-
-        self.push_manifest(commit_msg)
-        self.generate_final_files()
+        # Timings (and the size of what each step produced) are written
+        # to build-timings.json however the run ends
+        try:
+            def input_manifest():
+                return file_size(pathlib.Path('manifest') / self.manifest)
+
+            with self.phase('do_manifest_stuff', input_manifest):
+                self.do_manifest_stuff()
+
+            module_projects = self.manifest_config.get('module_projects')
+            if module_projects is not None:
+                with self.phase('update_submodules', input_manifest):
+                    self.update_submodules(module_projects)
+
+            self.set_relevant_parameters()
+            self.set_build_parameters()
+            with self.phase('update_bm_repo_and_get_build_num',
+                            lambda: file_size(self.build_manifest_filename)):
+                self.update_bm_repo_and_get_build_num()
+
+            # Skip the sync entirely if it can be seen from the remotes
+            # that nothing has changed
+            if not self.force:
+                with self.phase('remote_unchanged'):
+                    unchanged = self.remote_unchanged()
+                if unchanged:
+                    self.exit_unchanged()
+
+            with self.phase('perform_repo_sync',
+                            lambda: pack_size(self.product_path)):
+                self.perform_repo_sync()
+
+            with pushd(self.product_path):
+                with self.phase('check_for_changes',
+                                lambda: file_size(self.output_files['CHANGELOG'])):
+                    self.check_for_changes()
+                commit_msg = self.update_build_manifest_annotations()
+
+            with self.phase('push_manifest',
+                            lambda: file_size(self.build_manifest_filename)):
+                self.push_manifest(commit_msg)
+            self.generate_final_files()
+        finally:
+            self.write_timings(start)
 
 
 def parse_args():
@@ -677,6 +1382,18 @@ def parse_args():
                              'are no repo changes')
     parser.add_argument('--no-push', action='store_true',
                         help='Do not push final build manifest')
+    parser.add_argument('--repo-mirror',
+                        help='Directory for a repo mirror shared between '
+                             'jobs, used as a reference when syncing')
+    parser.add_argument('--incremental-sync', action='store_true',
+                        help='Refresh an existing repo sync in place '
+                             'rather than syncing from scratch')
+    parser.add_argument('--tarball-cache',
+                        help='Directory for caching unchanged projects '
+                             'between source tarballs')
+    parser.add_argument('--tarball-cache-size', type=float, default=50,
+                        help='Size in GB the tarball cache is trimmed to '
+                             '(default: %(default)s)')
     parser.add_argument('manifest', help='Path to input manifest')
 
     args = parser.parse_args()
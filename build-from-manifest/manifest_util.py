@@ -2,14 +2,19 @@
 
 import argparse
 import contextlib
+import fcntl
+import hashlib
 import json
 import os
+import posixpath
 import pprint
 import re
 import sys
 import xml.etree.ElementTree as ET
 
-from subprocess import check_call, check_output
+from subprocess import (
+    DEVNULL, PIPE, CalledProcessError, Popen, check_call, check_output
+)
 
 
 @contextlib.contextmanager
@@ -20,6 +25,199 @@ def remember_cwd():
     finally:
         os.chdir(curdir)
 
+class ManifestMetadata(dict):
+    """
+    Metadata about one manifest. The manifest's full ElementTree is only
+    loaded, by calling load_manifest(), when the "_manifest" key is
+    first looked up
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.load_manifest = None
+
+    def __missing__(self, key):
+        if key != '_manifest' or self.load_manifest is None:
+            raise KeyError(key)
+        self['_manifest'] = self.load_manifest()
+        return self['_manifest']
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+class ManifestIndex:
+    """
+    Details read from manifest XML (currently just the VERSION
+    annotation), keyed by the manifest's git blob SHA so that unchanged
+    manifests never need to be parsed again. The index is saved in the
+    manifest repository's .git directory if it has one; otherwise it
+    only lasts for the current run. Manifests which match git's index
+    are looked up by the blob SHA git already has for them, so only
+    modified or untracked manifests need to be read to find theirs
+    """
+
+    # Bumped whenever the details kept for each manifest change
+    version = 1
+
+    def __init__(self, manifest_dir):
+        self.manifest_dir = os.path.abspath(manifest_dir)
+        self.path = None
+        git_dir = os.path.join(manifest_dir, ".git")
+        if os.path.isdir(git_dir):
+            self.path = os.path.join(git_dir, "manifest-metadata-index.json")
+
+        self.entries = {}
+        self.used = {}
+        self.changed = False
+        self.tracked = None
+
+        if self.path is not None and os.path.exists(self.path):
+            try:
+                with open(self.path) as fh:
+                    index = json.load(fh)
+                if index.get("version") == self.version:
+                    self.entries = index["manifests"]
+            except (OSError, ValueError, KeyError):
+                # A corrupt index is just rebuilt
+                self.entries = {}
+
+    @staticmethod
+    def blob_id(data):
+        """
+        The SHA git gives a blob with the given contents
+        """
+        return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+    def tracked_blobs(self):
+        """
+        Return the blob SHAs (keyed by path relative to the manifest
+        directory) of the files whose working tree copies match git's
+        index, listing them on first use
+        """
+
+        if self.tracked is not None:
+            return self.tracked
+
+        self.tracked = {}
+        if self.path is None:
+            return self.tracked
+        try:
+            listing = check_output(
+                ["git", "-C", self.manifest_dir, "ls-files", "-s", "-z"],
+                stderr=DEVNULL
+            ).decode()
+            modified = set(check_output(
+                ["git", "-C", self.manifest_dir, "diff", "--name-only",
+                 "--relative", "-z"],
+                stderr=DEVNULL
+            ).decode().split("\0"))
+        except (OSError, CalledProcessError):
+            return self.tracked
+
+        for entry in listing.split("\0"):
+            if not entry:
+                continue
+            info, path = entry.split("\t", 1)
+            mode, blob_id, stage = info.split()
+            # A symlink's blob holds its target's path rather than its
+            # target's contents, and unmerged files have no single blob
+            if mode == "120000" or stage != "0" or path in modified:
+                continue
+            self.tracked[path] = blob_id
+        return self.tracked
+
+    def details(self, manifest_path):
+        """
+        Return the details for the manifest at the given path (relative
+        to the manifest directory)
+        """
+
+        manifest_file = os.path.join(self.manifest_dir, manifest_path)
+
+        def read():
+            with open(manifest_file, "rb") as fh:
+                return fh.read()
+
+        blob_id = self.tracked_blobs().get(os.path.normpath(manifest_path))
+        if blob_id is not None:
+            return self.blob_details(blob_id, read)
+        data = read()
+        return self.blob_details(self.blob_id(data), lambda: data)
+
+    def blob_details(self, blob_id, read):
+        """
+        Return the details for the manifest with the given blob SHA,
+        calling read() to get its contents only if they're needed
+        """
+
+        entry = self.entries.get(blob_id)
+        if entry is None:
+            entry = _read_manifest_details(ET.fromstring(read()))
+            self.entries[blob_id] = entry
+            self.changed = True
+        self.used[blob_id] = entry
+        return entry
+
+    def save(self):
+        """
+        Save the entries used by this run, if anything has changed
+        """
+
+        if self.path is None or not (
+                self.changed or len(self.used) != len(self.entries)):
+            return
+
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as fh:
+            json.dump({"version": self.version, "manifests": self.used}, fh)
+        os.replace(tmp_path, self.path)
+
+
+def _read_manifest_details(root):
+    """
+    Extract the details kept in a ManifestIndex from a parsed manifest
+    """
+    verattr = root.find('project[@name="build"]/annotation[@name="VERSION"]')
+    if verattr is not None:
+        return {"version": verattr.get('value', "0.0.0")}
+    return {"version": "0.0.0"}
+
+class GitBlobReader:
+    """
+    Reads blobs from a git repository through a single long-running
+    'git cat-file --batch'
+    """
+
+    def __init__(self, repo_dir):
+        self.proc = Popen(
+            ["git", "-C", repo_dir, "cat-file", "--batch"],
+            stdin=PIPE, stdout=PIPE
+        )
+
+    def read(self, blob_id):
+        self.proc.stdin.write(f"{blob_id}\n".encode())
+        self.proc.stdin.flush()
+        header = self.proc.stdout.readline().decode().split()
+        if len(header) != 3:
+            raise KeyError(blob_id)
+        data = self.proc.stdout.read(int(header[2]))
+        self.proc.stdout.read(1)
+        return data
+
+    def close(self):
+        self.proc.stdin.close()
+        self.proc.wait()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
 def get_manifest_dir(manifest_repo):
     """
     Given a URL to a manifest repository, return the local path that
@@ -31,7 +229,8 @@ def get_manifest_dir(manifest_repo):
         re.sub(r'[:/& ?]', '_', manifest_repo)
     )
 
-def scan_manifests(manifest_repo="ssh://git@github.com/couchbase/manifest"):
+def scan_manifests(manifest_repo="ssh://git@github.com/couchbase/manifest",
+                   checkout=True):
     """
     Syncs to the "manifest" project from the given repository, and
     returns a list of metadata about all discovered manifests. This does
@@ -39,11 +238,43 @@ def scan_manifests(manifest_repo="ssh://git@github.com/couchbase/manifest"):
     directory.
 
     If manifest_repo is a local path, uses it directly without cloning.
+
+    If checkout is False, only the remote's default branch is fetched,
+    and manifests are read from its latest commit in the git object
+    store rather than the working tree, which is left alone. This lets
+    several processes read from one clone at once
+    """
+    if checkout or os.path.isdir(manifest_repo):
+        return get_metadata_for_products(sync_manifest_repo(manifest_repo))
+
+    # Sync manifest project into local directory based on mangled URL
+    os.makedirs("manifest", exist_ok=True)
+    manifest_dir = get_manifest_dir(manifest_repo)
+
+    # git takes ref locks while fetching, so concurrent fetches into one
+    # clone fail rather than wait; take turns to clone and fetch. Once
+    # fetched, the commit is read by SHA, so no lock is needed for that
+    with open(f"{manifest_dir}.lock", "w") as lock_fh:
+        fcntl.flock(lock_fh, fcntl.LOCK_EX)
+        if not os.path.isdir(manifest_dir):
+            check_call(
+                ["git", "clone", "--no-checkout", manifest_repo, manifest_dir]
+            )
+        commit = _fetch_default_branch(manifest_dir)
+
+    return get_metadata_for_commit(manifest_dir, commit)
+
+def sync_manifest_repo(manifest_repo):
+    """
+    Clones or updates the "manifest" project from the given repository
+    as scan_manifests() does, without reading any manifests, and returns
+    the path to the local checkout. If manifest_repo is a local path, it
+    is returned as is
     """
     # Check if manifest_repo is a local directory path
     if os.path.isdir(manifest_repo):
         print(f"Using existing local manifest directory: {manifest_repo}")
-        return get_metadata_for_products(manifest_repo)
+        return manifest_repo
 
     # Sync manifest project into local directory based on mangled URL
     os.makedirs("manifest", exist_ok=True)
@@ -51,13 +282,139 @@ def scan_manifests(manifest_repo="ssh://git@github.com/couchbase/manifest"):
 
     if not os.path.isdir(manifest_dir):
         check_call(["git", "clone", manifest_repo, manifest_dir])
+
     with remember_cwd():
         os.chdir(manifest_dir)
         print("Updating manifest repository...")
         check_call(["git", "fetch", "--all"])
         check_call(["git", "reset", "--hard", "origin/HEAD"])
 
-    return get_metadata_for_products(manifest_dir)
+    return manifest_dir
+
+def _fetch_default_branch(manifest_dir):
+    """
+    Fetch only the default branch of a manifest clone's origin, and
+    return the SHA of its latest commit
+    """
+
+    def default_branch():
+        return check_output(
+            ["git", "-C", manifest_dir, "symbolic-ref", "--short",
+             "refs/remotes/origin/HEAD"]
+        ).decode().strip().split("/", 1)[1]
+
+    print("Updating manifest repository...")
+    try:
+        branch = default_branch()
+    except Exception:
+        check_call(
+            ["git", "-C", manifest_dir, "remote", "set-head", "origin", "--auto"]
+        )
+        branch = default_branch()
+
+    check_call(
+        ["git", "-C", manifest_dir, "fetch", "origin",
+         f"+refs/heads/{branch}:refs/remotes/origin/{branch}"]
+    )
+    return check_output(
+        ["git", "-C", manifest_dir, "rev-parse",
+         f"refs/remotes/origin/{branch}^{{commit}}"]
+    ).decode().strip()
+
+def get_metadata_for_commit(manifest_dir, commit):
+    """
+    As get_metadata_for_products(), but reading product-config.json
+    files and manifests from the given commit of a local manifest
+    clone, rather than from its working tree.
+    manifest_dir: path to local manifest clone
+    commit: commit SHA (or other revision) to read
+    returns: dict (keyed by path to manifest) of dicts of metadata
+    """
+
+    manifest_dir = os.path.abspath(manifest_dir)
+
+    # path -> blob SHA for every file in the commit, and path -> target
+    # for every symlink, which a working tree would follow
+    blobs = {}
+    links = {}
+    listing = check_output(
+        ["git", "-C", manifest_dir, "ls-tree", "-r", "-z", "--full-tree",
+         commit]
+    ).decode()
+    for entry in listing.split("\0"):
+        if not entry:
+            continue
+        info, path = entry.split("\t", 1)
+        mode, obj_type, blob_id = info.split()
+        if obj_type != "blob":
+            continue
+        if mode == "120000":
+            links[path] = blob_id
+        else:
+            blobs[path] = blob_id
+    if links:
+        with GitBlobReader(manifest_dir) as reader:
+            links = {
+                path: reader.read(blob_id).decode()
+                for path, blob_id in links.items()
+            }
+
+    def blob_for(path):
+        # Follow symlinks in any component of the path, as opening it
+        # in a working tree would, giving up on cycles as the OS does
+        orig_path = path
+        for _ in range(40):
+            if path in blobs:
+                return blobs[path]
+            parts = path.split("/")
+            for i in range(1, len(parts) + 1):
+                prefix = "/".join(parts[:i])
+                if prefix in links:
+                    path = posixpath.normpath(posixpath.join(
+                        posixpath.dirname(prefix), links[prefix], *parts[i:]
+                    ))
+                    break
+            else:
+                break
+        raise FileNotFoundError(f"{orig_path} not found in {commit}")
+
+    def load_manifest(blob_id):
+        return ET.ElementTree(ET.fromstring(check_output(
+            ["git", "-C", manifest_dir, "cat-file", "blob", blob_id]
+        )))
+
+    # Same products as get_metadata_for_products() finds: those with a
+    # product-config.json below the top level, other than in the
+    # top-level dirs it doesn't walk
+    product_paths = sorted(
+        os.path.dirname(path) for path in set(blobs) | set(links)
+        if os.path.basename(path) == "product-config.json"
+        and "/" in path
+        and path.split("/", 1)[0] not in (".git", "toy", "released")
+    )
+
+    manifests = {}
+    index = ManifestIndex(manifest_dir)
+    with GitBlobReader(manifest_dir) as reader:
+        for product_path in product_paths:
+            config, override_product = _parse_product_config(json.loads(
+                reader.read(blob_for(f"{product_path}/product-config.json"))
+            ))
+            for manifest_path, metadata in config.items():
+                blob_id = blob_for(manifest_path)
+                details = index.blob_details(
+                    blob_id, lambda: reader.read(blob_id)
+                )
+                metadata['version'] = details['version']
+                metadata.load_manifest = \
+                    lambda blob_id=blob_id: load_manifest(blob_id)
+                _add_derived_metadata(
+                    metadata, manifest_path, product_path, override_product
+                )
+                manifests[manifest_path] = metadata
+
+    index.save()
+    return manifests
 
 def get_metadata_for_products(manifest_dir):
     """
@@ -68,6 +425,7 @@ def get_metadata_for_products(manifest_dir):
     """
     # Scan the current directory for input manifests.
     manifests = {}
+    index = ManifestIndex(manifest_dir)
     with remember_cwd():
         os.chdir(manifest_dir)
         for root, dirs, files in os.walk("."):
@@ -86,10 +444,12 @@ def get_metadata_for_products(manifest_dir):
                 # Strip leading "./" from root (pass character 2 onwards)
                 prod_manifests = _get_metadata_for_product(
                     os.getcwd(),
-                    root[2:]
+                    root[2:],
+                    index
                 )
                 manifests.update(prod_manifests)
 
+    index.save()
     return manifests
 
 
@@ -101,18 +461,30 @@ def _load_product_config(manifest_dir, product_path):
 
     prod_config = os.path.join(manifest_dir, product_path, "product-config.json")
     with open(prod_config, "r") as conffile:
-        config = json.load(conffile)
+        return _parse_product_config(json.load(conffile))
+
+
+def _parse_product_config(config):
+    """
+    As _load_product_config(), for an already-loaded product-config.json
+    """
+
     if "manifests" not in config:
         return {}
-    return (config["manifests"], config.get("product", None))
+    manifests = {
+        manifest_path: ManifestMetadata(metadata)
+        for manifest_path, metadata in config["manifests"].items()
+    }
+    return (manifests, config.get("product", None))
 
 
-def _get_metadata_for_product(manifest_dir, product_path):
+def _get_metadata_for_product(manifest_dir, product_path, index=None):
     """
     Loads metadata about all manifests in a given product subdir
     manifest_dir: root of a manifest repository.
     product_path: relative path to subdir of repository. Subdir
     is presumed to have a "product-config.json" at the root.
+    index: ManifestIndex to look up manifest details in, if any
     returns: dict (keyed by manifest paths) of dicts of metadata
     """
 
@@ -120,17 +492,19 @@ def _get_metadata_for_product(manifest_dir, product_path):
     prod_metadata = config.items()
     for manifest_path, metadata in prod_metadata:
         _append_manifest_metadata(
-            metadata, manifest_dir, manifest_path, product_path, override_product
+            metadata, manifest_dir, manifest_path, product_path,
+            override_product, index
         )
     return prod_metadata
 
 
-def _append_manifest_metadata(metadata, manifest_dir, manifest_path, product_path, override_product):
+def _append_manifest_metadata(metadata, manifest_dir, manifest_path, product_path, override_product, index=None):
     """
     Extends a manifest-specific dict with additional metadata derived
     from the product path, product-config, and manifest contents.
-    Also saves the full manifest ElementTree root in the metadata with
-    the key "_manifest".
+    Also makes the full manifest ElementTree available in the metadata
+    with the key "_manifest" (loaded on first use for a
+    ManifestMetadata).
     metadata: input dict to extend
     manifest_dir: root of manifest repository checkout
     manifest_path: path (relative to manifest_dir) to a manifest.xml
@@ -138,6 +512,27 @@ def _append_manifest_metadata(metadata, manifest_dir, manifest_path, product_pat
     a product-config.json)
     override_product: if product-config.json has a top-level "product" key,
     that value; otherwise None
+    index: ManifestIndex to look up the manifest's details in, rather
+    than parsing the manifest, if any
+    """
+
+    # VERSION comes from the manifest itself, which only needs parsing
+    # if it's not in the index
+    manifest_file = os.path.join(manifest_dir, manifest_path)
+    if index is not None and isinstance(metadata, ManifestMetadata):
+        details = index.details(manifest_path)
+        metadata.load_manifest = lambda: ET.parse(manifest_file)
+    else:
+        root = ET.parse(manifest_file)
+        details = _read_manifest_details(root)
+        metadata['_manifest'] = root
+    metadata['version'] = details['version']
+    _add_derived_metadata(metadata, manifest_path, product_path, override_product)
+
+
+def _add_derived_metadata(metadata, manifest_path, product_path, override_product):
+    """
+    Adds the metadata derived from a manifest's path and product
     """
 
     if override_product is not None:
@@ -147,39 +542,34 @@ def _append_manifest_metadata(metadata, manifest_dir, manifest_path, product_pat
         # Otherwise, product name is derived from product path
         product = product_path.replace('/', '::')
 
-    # Have to actually parse the manifest to extract VERSION
-    root = ET.parse(os.path.join(manifest_dir, manifest_path))
-    verattr = root.find('project[@name="build"]/annotation[@name="VERSION"]')
-    if verattr is not None:
-        metadata['version'] = verattr.get('value', "0.0.0")
-    else:
-        metadata['version'] = "0.0.0"
-
     # Derived values are here
     metadata['product'] = product
     metadata['product_path'] = product_path
     metadata['manifest_path'] = manifest_path
     metadata['prod_name'] = product.split('::')[-1]
     metadata['build_job'] = metadata.get('jenkins_job', f'{product}-build')
-    metadata['_manifest'] = root
 
 
-def get_metadata_for_manifest(manifest_dir, manifest_path):
+def get_metadata_for_manifest(manifest_dir, manifest_path, product_path=None):
     """
     Alternate entrypoint for loading metadata about exactly one manifest.
     manifest_dir: root of a manifest repository checkout
     manifest_path: path (relative to manifest_dir) to a specific .xml file
+    product_path: path (relative to manifest_dir) of the product whose
+    product-config.json lists the manifest; if None, the nearest one
+    above the manifest is used
     returns: dict of all known metadata about the product-version represented
     by the manifest
     """
-    product_path = os.path.dirname(manifest_path)
-    while not os.path.exists(os.path.join(
-        manifest_dir, product_path, "product-config.json"
-    )):
-        product_path = os.path.dirname(product_path)
-        if len(product_path) < 2:
-            print (f"No product-config.json found above {manifest_path}!")
-            sys.exit(1)
+    if product_path is None:
+        product_path = os.path.dirname(manifest_path)
+        while not os.path.exists(os.path.join(
+            manifest_dir, product_path, "product-config.json"
+        )):
+            product_path = os.path.dirname(product_path)
+            if len(product_path) < 2:
+                print (f"No product-config.json found above {manifest_path}!")
+                sys.exit(1)
     config, override_product = _load_product_config(manifest_dir, product_path)
     metadata = config[manifest_path]
     _append_manifest_metadata(metadata, manifest_dir, manifest_path, product_path, override_product)
@@ -197,6 +587,9 @@ if __name__ == '__main__':
     parser.add_argument("-m", "--manifest-file", type=str,
                         default=None,
                         help="Specific manifest to show info about (default: all)")
+    parser.add_argument("--no-checkout", action="store_true",
+                        help="Read manifests from the manifest project's "
+                             "default branch without checking it out")
     args = parser.parse_args()
     pp = pprint.PrettyPrinter(indent=2)
 
@@ -210,7 +603,9 @@ if __name__ == '__main__':
                 args.manifest_dir
             ))
     else:
-        details = scan_manifests(args.manifest_project)
+        details = scan_manifests(
+            args.manifest_project, checkout=not args.no_checkout
+        )
         if args.manifest_file is not None:
             pp.pprint(details[args.manifest_file])
         else:
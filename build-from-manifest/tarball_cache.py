@@ -0,0 +1,109 @@
+"""
+Cache of compressed per-project source tarball fragments, shared by
+builds on the same agent. A fragment is named by a hash of everything
+which determines its contents (the project's path and revision, the
+compression used and any fixed modification time), so a project which
+hasn't changed since an earlier build can be copied into the new
+tarball rather than archived and compressed again. Least recently
+used fragments are removed once the cache grows beyond its size limit.
+
+Each fragment starts with a line holding the SHA-256 of its
+uncompressed tar data, so the source digest can be worked out without
+decompressing it.
+"""
+
+import contextlib
+import hashlib
+import os
+import pathlib
+
+
+class TarballCache:
+    # Bumped whenever the fragment contents change for the same inputs,
+    # so older fragments are never reused
+    version = 3
+
+    def __init__(self, cache_dir, max_size):
+        """
+        cache_dir: directory holding the fragments
+        max_size: total size in bytes the fragments are trimmed to
+        """
+
+        self.cache_dir = pathlib.Path(cache_dir)
+        self.max_size = max_size
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def key(self, compression, path, revision, mtime=None):
+        """
+        mtime: the modification time given to every entry, if any
+        """
+
+        return hashlib.sha256(
+            f'{self.version}\0{compression}\0{path}\0{revision}\0{mtime}'.encode()
+        ).hexdigest()
+
+    def fragment(self, key):
+        return self.cache_dir / f'{key}.frag'
+
+    def get(self, key):
+        """
+        Return the SHA-256 of a cached fragment's tar data and a binary
+        file object positioned at its compressed data, or None if there
+        isn't one. Using a fragment marks it as recently used
+        """
+
+        try:
+            fh = open(self.fragment(key), 'rb')
+        except FileNotFoundError:
+            return None
+        os.utime(fh.fileno())
+        digest = fh.readline().decode('ascii').strip()
+        return digest, fh
+
+    @contextlib.contextmanager
+    def put(self, key):
+        """
+        Yield a binary file object for a new fragment's compressed
+        data and a hash object to be updated with its tar data. The
+        fragment only appears in the cache once it has been written
+        successfully
+        """
+
+        fragment = self.fragment(key)
+        tmp_path = fragment.with_name(f'{fragment.name}.{os.getpid()}.tmp')
+        sha256 = hashlib.sha256()
+        header_size = sha256.digest_size * 2 + 1
+        try:
+            with open(tmp_path, 'wb') as fh:
+                fh.write(b' ' * header_size)
+                yield fh, sha256
+                fh.seek(0)
+                fh.write(f'{sha256.hexdigest()}\n'.encode('ascii'))
+            os.replace(tmp_path, fragment)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+
+    def evict(self):
+        """
+        Remove the least recently used fragments until the cache is
+        no bigger than max_size
+        """
+
+        fragments = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.frag'):
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    # Already removed by another build
+                    continue
+                fragments.append((st.st_mtime, st.st_size, entry.path))
+
+        total = sum(size for _, size, _ in fragments)
+        for _, size, path in sorted(fragments):
+            if total <= self.max_size:
+                break
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(path)
+            total -= size
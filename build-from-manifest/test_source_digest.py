@@ -0,0 +1,128 @@
+"""
+Check that reproducible source tarballs of unchanged sources get the
+same source digest and tar data from build to build, with or without
+the tarball cache, even though the build manifest inside them differs.
+
+Run with pytest from this directory:
+    python -m pytest test_source_digest.py
+"""
+
+import contextlib
+import gzip
+import io
+import tarfile
+
+import pytest
+
+from build_from_manifest import ManifestBuilder
+from tarball_cache import TarballCache
+
+REVISION = 'a' * 40
+SOURCE_DATE = 1700000000
+
+
+@pytest.fixture
+def product(tmp_path):
+    product_dir = tmp_path / 'couchbase'
+    for path in ['top.txt', 'a/f.txt', 'a/sub/g.txt', 'a/.git/HEAD',
+                 'b/h.txt', 'b/n/i.txt']:
+        (product_dir / path).parent.mkdir(parents=True, exist_ok=True)
+        (product_dir / path).write_text(path)
+
+    build_manifest = tmp_path / 'build-manifest.xml'
+    build_manifest.write_text(
+        '<manifest>'
+        f'<project name="a" revision="{REVISION}"/>'
+        f'<project name="b" revision="{REVISION}"/>'
+        f'<project name="bn" path="b/n" revision="{REVISION}"/>'
+        '</manifest>'
+    )
+    return tmp_path
+
+
+def build(top, build_num, cache=None, reproducible=True):
+    """
+    Create the source tarball for a build, returning the source digest
+    and the uncompressed tar data
+    """
+
+    product_dir = top / 'couchbase'
+    (product_dir / 'manifest.xml').write_text(
+        f'<manifest><!-- BLD_NUM={build_num} --></manifest>')
+
+    out_dir = top / f'build-{build_num}'
+    out_dir.mkdir()
+    builder = object.__new__(ManifestBuilder)
+    builder.manifest_config = {'reproducible_source_tarball': reproducible}
+    builder.output_files = {'source.tar.gz': out_dir / 'source.tar.gz'}
+    builder.product_path = str(product_dir)
+    builder.build_manifest_filename = str(top / 'build-manifest.xml')
+    builder.tarball_cache = cache
+    builder.source_digest = None
+    builder.source_date = lambda: SOURCE_DATE
+    builder.create_tarball()
+
+    data = gzip.decompress(builder.output_files['source.tar.gz'].read_bytes())
+    return builder.source_digest, data
+
+
+class EvictingCache(TarballCache):
+    """
+    A cache whose fragments are evicted (as by another build) as soon
+    as they've been added
+    """
+
+    @contextlib.contextmanager
+    def put(self, key):
+        with super().put(key) as result:
+            yield result
+        self.fragment(key).unlink()
+
+
+def without_manifest(data):
+    with tarfile.open(fileobj=io.BytesIO(data)) as tar_fh:
+        manifest = tar_fh.getmember('manifest.xml')
+    return data[:manifest.offset]
+
+
+def test_unchanged_sources(product):
+    cache = TarballCache(product / 'cache', 1024 ** 3)
+    builds = [
+        build(product, 1),
+        build(product, 2, cache),
+        # Every project comes from the cache this time
+        build(product, 3, cache),
+    ]
+
+    digests = {digest for digest, _ in builds}
+    assert len(digests) == 1 and None not in digests
+    assert len({without_manifest(data) for _, data in builds}) == 1
+
+    with tarfile.open(fileobj=io.BytesIO(builds[0][1])) as tar_fh:
+        assert tar_fh.getnames() == [
+            'top.txt', 'a', 'a/f.txt', 'a/sub', 'a/sub/g.txt',
+            'b', 'b/h.txt', 'b/n', 'b/n/i.txt', 'manifest.xml'
+        ]
+
+
+def test_changed_sources(product):
+    digest, _ = build(product, 1)
+    (product / 'couchbase' / 'top.txt').write_text('changed')
+    assert build(product, 2)[0] != digest
+
+
+def test_not_reproducible(product):
+    digest, data = build(product, 1, reproducible=False)
+    assert digest is None
+
+    with tarfile.open(fileobj=io.BytesIO(data)) as tar_fh:
+        tarinfo = tar_fh.getmember('top.txt')
+    assert tarinfo.mtime != SOURCE_DATE
+    assert tarinfo.uname != '' or tarinfo.uid != 0
+
+
+def test_evicted_fragments(product):
+    digest, data = build(product, 1)
+    evicted = build(product, 2, EvictingCache(product / 'cache', 1024 ** 3))
+    assert evicted[0] == digest
+    assert without_manifest(evicted[1]) == without_manifest(data)
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Compare the DiffIndex-backed diff matching used by find_missing_commits
+against the original approach of calling fuzz.ratio() on every pair of
+source-only/target-only commits. Synthetic diffs are generated with a
+proportion of (lightly edited) cherry-picks, both approaches are run,
+their results are checked to be identical and the timings reported.
+
+Needs manifest_tools to be importable, e.g. from the manifest-tools
+directory:
+    PYTHONPATH=. python benchmarks/bench_diff_match.py --source 300 --target 3000
+"""
+import argparse
+import random
+import sys
+import time
+
+from thefuzz import fuzz
+
+from manifest_tools.scripts.diff_index import DiffIndex
+from manifest_tools.scripts.find_missing_commits import MissingCommits
+
+
+def make_diff(rng, vocabulary, size):
+    return [f"{rng.choice('+-')}{rng.choice(vocabulary)}" for _ in range(size)]
+
+
+def make_diffs(rng, args):
+    """
+    Return (source_diffs, target_diffs); a proportion of the source
+    diffs are copies of target diffs with a few lines changed
+    """
+
+    # A smallish vocabulary means plenty of shared lines between unrelated
+    # diffs (braces, blank lines, common statements), like real code
+    vocabulary = [f"line {i} {'x' * (i % 40)}" for i in range(args.vocabulary)]
+    vocabulary += ['', '}', '{', '    return;', '#include <string>'] * 20
+
+    def size():
+        return max(1, int(rng.expovariate(1 / args.diff_size)))
+
+    target = [make_diff(rng, vocabulary, size()) for _ in range(args.target)]
+    source = []
+    for _ in range(args.source):
+        if target and rng.random() < args.cherry_pick_ratio:
+            diff = list(rng.choice(target))
+            for _ in range(rng.randint(0, max(1, len(diff) // 10))):
+                diff[rng.randrange(len(diff))] = f"+{rng.choice(vocabulary)}"
+            source.append(diff)
+        else:
+            source.append(make_diff(rng, vocabulary, size()))
+    return source, target
+
+
+def pairwise(source, target):
+    """
+    The original match_diff(): first target commit beating the threshold
+    """
+
+    matches = []
+    for new_diff in source:
+        threshold = MissingCommits.diff_threshold(new_diff)
+        for i, old_diff in enumerate(target):
+            ratio = fuzz.ratio(new_diff, old_diff)
+            if ratio > threshold:
+                matches.append((i, ratio))
+                break
+        else:
+            matches.append(None)
+    return matches
+
+
+def indexed(source, target):
+    """
+    match_diff() as it is now, using a DiffIndex built once per project
+    """
+
+    index = DiffIndex(target)
+    matches = []
+    for new_diff in source:
+        threshold = MissingCommits.diff_threshold(new_diff)
+        for i in index.candidates(new_diff, threshold):
+            ratio = fuzz.ratio(new_diff, target[i])
+            if ratio > threshold:
+                matches.append((i, ratio))
+                break
+        else:
+            matches.append(None)
+    return matches
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark DiffIndex against pairwise fuzz.ratio')
+    parser.add_argument('--source', type=int, default=200,
+                        help='Number of source-only commits')
+    parser.add_argument('--target', type=int, default=2000,
+                        help='Number of target-only commits')
+    parser.add_argument('--diff-size', type=int, default=40,
+                        help='Mean number of +/- lines per diff')
+    parser.add_argument('--vocabulary', type=int, default=5000,
+                        help='Number of distinct lines to draw diffs from')
+    parser.add_argument('--cherry-pick-ratio', type=float, default=0.5,
+                        help='Proportion of source commits copied from target')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    source, target = make_diffs(random.Random(args.seed), args)
+
+    start = time.perf_counter()
+    expected = pairwise(source, target)
+    pairwise_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    actual = indexed(source, target)
+    indexed_time = time.perf_counter() - start
+
+    matched = sum(1 for match in expected if match is not None)
+    print(f"{len(source)} source x {len(target)} target diffs, "
+          f"{matched} matched")
+    print(f"pairwise: {pairwise_time:.2f}s")
+    print(f"indexed:  {indexed_time:.2f}s "
+          f"({pairwise_time / max(indexed_time, 1e-9):.1f}x faster)")
+
+    if actual != expected:
+        mismatches = sum(1 for a, b in zip(actual, expected) if a != b)
+        print(f"ERROR: {mismatches} results differ")
+        sys.exit(1)
+    print("Results identical")
+
+
+if __name__ == '__main__':
+    main()
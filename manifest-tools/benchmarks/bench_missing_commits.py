@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark for find_missing_commits against synthetic data, so
+changes to collecting, matching or recording commits can be measured
+without a real product checkout, Jira or the network.
+
+A set of local git repositories is generated (with git fast-import), each
+with one branch per release. Every release carries its own commits plus
+some of the older releases' commits, brought forward in different ways:
+  - exact cherry-picks (dropped by 'git log --cherry-pick')
+  - cherry-picks with the same author and date but a changed diff
+    (date matches)
+  - edited versions of the change (diff matches)
+  - unrelated changes with the same summary (summary matches)
+  - changes under a different ticket, which Jira says the original is a
+    backport of (backport matches)
+and the rest are missing. A manifest per release is written to a fake
+manifest repository, and MissingCommits is run over every pair with
+repo_sync() and diff_manifests() replaced by in-process equivalents and
+a stub in place of Jira.
+
+Needs manifest_tools to be importable, e.g. from the manifest-tools
+directory:
+    PYTHONPATH=. python benchmarks/bench_missing_commits.py --projects 20 --commits 300
+"""
+import argparse
+import json
+import logging
+import os
+import pathlib
+import random
+import resource
+import shutil
+import subprocess
+import tempfile
+import time
+import types
+
+from itertools import combinations
+
+import manifest_tools.scripts.find_missing_commits as find_missing_commits
+from manifest_tools.scripts.manifest_model import load_manifest
+
+
+PRODUCT = 'bench'
+
+
+class FakeJira:
+    """
+    Just enough of jira.JIRA for MissingCommits: each ticket's "is a
+    backport of" links come from a dict
+    """
+
+    def __init__(self, backports):
+        self.backports = backports
+
+    def _issue(self, key):
+        links = [
+            {"type": {"outward": "is a backport of"},
+             "outwardIssue": {"key": backport}}
+            for backport in self.backports.get(key, [])
+        ]
+        return types.SimpleNamespace(
+            key=key, raw={"fields": {"issuelinks": links}})
+
+    def issue(self, key):
+        return self._issue(key)
+
+    def search_issues(self, jql, **kwargs):
+        keys = jql[jql.index('(') + 1:jql.rindex(')')].split(',')
+        return [self._issue(key) for key in keys]
+
+
+class FastImport:
+    """
+    Builds up a git fast-import stream of commits which each add or
+    replace whole files
+    """
+
+    def __init__(self, start_time):
+        self.parts = []
+        self.marks = 0
+        self.time = start_time
+
+    def data(self, text):
+        encoded = text.encode()
+        self.parts.append(b'data %d\n' % len(encoded) + encoded + b'\n')
+
+    def commit(self, ref, parent, message, author, files, author_time=None):
+        """
+        Add a commit to ref, returning (mark, author time)
+        """
+
+        self.marks += 1
+        self.time += 60
+        author_time = author_time or self.time
+        self.parts.append(
+            f'commit {ref}\nmark :{self.marks}\n'
+            f'author {author} <{author}> {author_time} +0000\n'
+            f'committer Bench <bench@example.com> {self.time} +0000\n'.encode())
+        self.data(message)
+        if parent is not None:
+            self.parts.append(f'from :{parent}\n'.encode())
+        for path, content in files.items():
+            self.parts.append(f'M 644 inline {path}\n'.encode())
+            self.data(content)
+        return self.marks, author_time
+
+    def run(self, git_dir):
+        subprocess.run(['git', 'fast-import', '--quiet'], cwd=git_dir,
+                       input=b''.join(self.parts), check=True)
+
+
+def make_content(rng, args):
+    size = max(1, int(rng.expovariate(1 / args.diff_size)))
+    return ''.join(
+        f'line {rng.randrange(args.vocabulary)}\n' for _ in range(size))
+
+
+def edit_content(rng, args, content):
+    lines = content.splitlines(keepends=True)
+    for _ in range(max(1, len(lines) // 10)):
+        lines[rng.randrange(len(lines))] = f'edited {rng.randrange(args.vocabulary)}\n'
+    return ''.join(lines)
+
+
+def build_project(project_dir, project, releases, args, rng, backports, tickets):
+    """
+    Create one project's repository, with a branch per release under
+    refs/remotes/origin (where MissingCommits expects to find them)
+    """
+
+    subprocess.run(['git', 'init', '-q', str(project_dir)], check=True)
+    authors = [f'dev{i}@example.com' for i in range(args.authors)]
+    stream = FastImport(1600000000)
+    base, _ = stream.commit('refs/heads/base', None, 'Initial import',
+                            authors[0], {'README': f'{project}\n'})
+
+    # Each release's own commits: (path, content, subject, author, author time)
+    own = {}
+    for j, release in enumerate(releases):
+        ref = f'refs/remotes/origin/{release}'
+        events = [('own', n) for n in range(args.commits)]
+        events += [('carry', commit) for i in range(j) for commit in own[releases[i]]]
+        rng.shuffle(events)
+
+        parent = base
+        own[release] = []
+        for kind, detail in events:
+            author = rng.choice(authors)
+            if kind == 'own':
+                ticket = next(tickets)
+                path = f'{release}/{detail}.txt'
+                content = make_content(rng, args)
+                subject = f'MB-{ticket} {release} change {detail} in {project}'
+                parent, author_time = stream.commit(
+                    ref, parent, subject, author, {path: content})
+                own[release].append((path, content, subject, author, author_time))
+                continue
+
+            path, content, subject, orig_author, orig_time = detail
+            fate = rng.random()
+            thresholds = [args.cherry_pick_ratio * share for share in (0.5, 0.25, 0.25)]
+            if fate < thresholds[0]:
+                # Exact cherry-pick
+                parent, _ = stream.commit(
+                    ref, parent, f'{subject}\n\n(cherry picked)', orig_author,
+                    {path: content}, orig_time)
+                continue
+            fate -= thresholds[0]
+            if fate < thresholds[1]:
+                # Cherry-pick needing conflict resolution
+                parent, _ = stream.commit(
+                    ref, parent, f'{subject} (resolved)', orig_author,
+                    {path: make_content(rng, args)}, orig_time)
+                continue
+            fate -= thresholds[1]
+            if fate < thresholds[2]:
+                # Reworked version of the same change
+                parent, _ = stream.commit(
+                    ref, parent, f'Rework of change in {project}', author,
+                    {path: edit_content(rng, args, content)})
+                continue
+            fate -= thresholds[2]
+            if fate < args.summary_ratio:
+                parent, _ = stream.commit(
+                    ref, parent, subject, author,
+                    {f'{release}/summary-{stream.marks}.txt': make_content(rng, args)})
+                continue
+            fate -= args.summary_ratio
+            if fate < args.backport_ratio:
+                ticket = next(tickets)
+                backports.setdefault(subject.split()[0], []).append(f'MB-{ticket}')
+                parent, _ = stream.commit(
+                    ref, parent, f'MB-{ticket}: forward port to {release}', author,
+                    {f'{release}/forward-{stream.marks}.txt': make_content(rng, args)})
+                continue
+            # Otherwise it's missing
+
+    stream.run(project_dir)
+
+
+def build_tree(work_dir, args):
+    """
+    Generate the checkout and manifest repository, returning the Jira
+    backport links
+    """
+
+    rng = random.Random(args.seed)
+    releases = [f'release-{k}' for k in range(args.manifests)]
+    checkout = work_dir / PRODUCT
+    manifest_dir = work_dir / 'manifests'
+    (manifest_dir / PRODUCT).mkdir(parents=True)
+
+    backports = {}
+    tickets = iter(range(1000, 10 ** 7))
+    projects = [f'proj{n}' for n in range(args.projects)]
+    for project in projects:
+        build_project(checkout / project, project, releases, args, rng,
+                      backports, tickets)
+
+    # Manifests are listed newest first in product-config.json
+    config = {"manifests": {
+        f'{PRODUCT}/{release}.xml': {} for release in reversed(releases)}}
+    with open(manifest_dir / PRODUCT / 'product-config.json', 'w') as fh:
+        json.dump(config, fh)
+    for release in releases:
+        with open(manifest_dir / PRODUCT / f'{release}.xml', 'w') as fh:
+            fh.write(
+                '<manifest>\n'
+                '  <remote name="origin" fetch="https://git.example.com/"/>\n'
+                f'  <default remote="origin" revision="{release}"/>\n'
+                + ''.join(f'  <project name="{project}" path="{project}"/>\n'
+                          for project in projects)
+                + '</manifest>\n')
+
+    # project_url() looks for the manifests under the checkout
+    (checkout / '.repo').mkdir()
+    (checkout / '.repo' / 'manifests').symlink_to(manifest_dir.resolve())
+    return backports
+
+
+class BenchMissingCommits(find_missing_commits.MissingCommits):
+    """
+    MissingCommits with syncing and manifest diffs done in-process against
+    the generated checkout, which never changes
+    """
+
+    classified = 0
+
+    def repo_sync(self):
+        manifest = load_manifest(self.manifest_dir / self.new_manifest)
+        with open('new.xml', 'w') as fh:
+            fh.write(
+                '<manifest>\n'
+                + ''.join(
+                    f'  <remote name="{name}" fetch="{fetch}"/>\n'
+                    for name, fetch in manifest.remotes.items())
+                + ''.join(
+                    f'  <project name="{project["name"]}" path="{path}" '
+                    f'remote="{project["remote"]}" revision="'
+                    + self.resolve_ref(
+                        path, f'refs/remotes/{project["remote"]}/{project["revision"]}')
+                    + '"/>\n'
+                    for path, project in manifest.paths.items())
+                + '</manifest>\n')
+
+    def diff_manifests(self):
+        old = load_manifest(self.manifest_dir / self.old_manifest).paths
+        new = load_manifest('new.xml').paths
+        diffs = []
+        for path in sorted(set(old) & set(new)):
+            old_revision = old[path]["revision"]
+            new_revision = new[path]["revision"]
+            if self.get_long_sha(path, old_revision) != new_revision:
+                diffs.append(f'C {path} {old_revision} {new_revision}')
+        return diffs
+
+    def get_ignored_commits(self):
+        return []
+
+    def show_needed_commits(self, project_commits, outcomes):
+        self.classified += len(outcomes)
+        super().show_needed_commits(project_commits, outcomes)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark find_missing_commits on synthetic repositories')
+    parser.add_argument('--projects', type=int, default=10,
+                        help='Number of projects')
+    parser.add_argument('--commits', type=int, default=200,
+                        help='Number of new commits per project per release')
+    parser.add_argument('--manifests', type=int, default=4,
+                        help='Number of releases (and so manifests)')
+    parser.add_argument('--cherry-pick-ratio', type=float, default=0.6,
+                        help='Proportion of older commits cherry-picked '
+                             'forward (exactly, with conflicts, or reworked)')
+    parser.add_argument('--summary-ratio', type=float, default=0.1,
+                        help='Proportion of older commits with a same-summary '
+                             'counterpart')
+    parser.add_argument('--backport-ratio', type=float, default=0.1,
+                        help='Proportion of older commits forward-ported '
+                             'under a backport-linked ticket')
+    parser.add_argument('--diff-size', type=int, default=20,
+                        help='Mean number of lines per commit')
+    parser.add_argument('--vocabulary', type=int, default=5000,
+                        help='Number of distinct lines to draw diffs from')
+    parser.add_argument('--authors', type=int, default=5,
+                        help='Number of distinct commit authors')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Worker processes for MissingCommits')
+    parser.add_argument('--linear', action='store_true',
+                        help='Use the linear-chain comparison')
+    parser.add_argument('--cache-file',
+                        help='Commit cache for MissingCommits (e.g. to time '
+                             'a warm cache)')
+    parser.add_argument('--work-dir',
+                        help='Directory to generate the data in; if it has '
+                             'already been generated there it is reused, and '
+                             'the options describing its shape are ignored '
+                             '(default: a temporary directory)')
+    parser.add_argument('--json',
+                        help='Write the results (and phase timings) to this file')
+    args = parser.parse_args()
+
+    if args.work_dir:
+        work_dir = pathlib.Path(args.work_dir).resolve()
+        cleanup = False
+    else:
+        work_dir = pathlib.Path(tempfile.mkdtemp(prefix='bench-missing-commits-'))
+        cleanup = True
+
+    try:
+        start = time.perf_counter()
+        # The shape of the generated data and the Jira links to go with it
+        data_file = work_dir / 'bench.json'
+        if not data_file.exists():
+            work_dir.mkdir(parents=True, exist_ok=True)
+            shape = {
+                key: value for key, value in vars(args).items()
+                if key not in ('jobs', 'linear', 'cache_file', 'work_dir', 'json')
+            }
+            with open(data_file, 'w') as fh:
+                json.dump({"shape": shape, "backports": build_tree(work_dir, args)}, fh)
+            print(f"Generated data in {time.perf_counter() - start:.2f}s")
+        with open(data_file) as fh:
+            data = json.load(fh)
+
+        os.chdir(work_dir)
+        logger = logging.getLogger('bench')
+        logger.addHandler(logging.NullHandler())
+        logger.propagate = False
+        find_missing_commits.connect_jira = lambda: FakeJira(data["backports"])
+
+        checker = BenchMissingCommits(
+            logger, PRODUCT, work_dir / 'manifests', 'https://git.example.com/manifest',
+            None, None, None, None, False, True, False, False, False,
+            cache_file=args.cache_file, jobs=args.jobs)
+
+        start = time.perf_counter()
+        if args.linear:
+            checker.identify_missing_commits_linear()
+        else:
+            for old_manifest, new_manifest in combinations(checker.manifests, 2):
+                checker.identify_missing_commits(old_manifest, new_manifest)
+        elapsed = time.perf_counter() - start
+        if checker.commit_cache is not None:
+            checker.commit_cache.close()
+
+        own_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        child_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+        results = {
+            "shape": data["shape"],
+            "jobs": args.jobs,
+            "linear": args.linear,
+            "classified": checker.classified,
+            "missing": checker.total_missing,
+            "matched": checker.matched_commits,
+            "seconds": elapsed,
+            "commits_per_second": checker.classified / elapsed if elapsed else 0,
+            "peak_rss_mb": own_rss,
+            "peak_child_rss_mb": child_rss,
+        }
+
+        print(f"{checker.classified} commits classified in {elapsed:.2f}s "
+              f"({results['commits_per_second']:.0f}/s): "
+              f"{checker.total_missing} missing, {checker.matched_commits} matched")
+        print(f"Peak RSS {own_rss:.0f} MB (largest child {child_rss:.0f} MB)")
+        for name, stats in sorted(checker.timings.as_dict()["phases"].items(),
+                                  key=lambda item: -item[1]["wall"]):
+            print(f"  {name:20} {stats['wall']:8.2f}s {stats['calls']:8} calls "
+                  f"{stats['subprocesses']:6} subprocesses")
+
+        if args.json:
+            with open(args.json, 'w') as fh:
+                json.dump(dict(results, timings=checker.timings.as_dict()),
+                          fh, indent=2)
+    finally:
+        if cleanup:
+            os.chdir('/')
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -15,6 +15,8 @@ show_help(){
     echo "  --show-matches                     Show matched commits as well as unmatched"
     echo "  --compare-builds                   Compare specific builds, not release trains"
     echo "  --no-sync                          Do not synchronise repositories (useful for debugging)"
+    echo "  --persistent-checkout              Reuse one repo checkout for all manifest pairs (kept between runs)"
+    echo "  --incremental                      Only recheck projects which have changed since the last run"
     echo "  -h, --help                         Display this help and exit"
 }
 
@@ -23,7 +25,7 @@ if [ $# -eq 0 ]; then
     exit 0
 fi
 
-ARGS=$(getopt -o h -l help,product:,project:,first-manifest:,last-manifest:,test-email:,only-boundaries,show-matches,no-sync,notify,debug -- "$@")
+ARGS=$(getopt -o h -l help,product:,project:,first-manifest:,last-manifest:,test-email:,only-boundaries,show-matches,no-sync,persistent-checkout,incremental,notify,debug -- "$@")
 
 if [ $? -ne 0 ]; then
     echo "Failed to parse arguments"
@@ -104,6 +106,15 @@ while true; do
             SYNC=false
             shift
             ;;
+        --persistent-checkout)
+            PERSISTENT_CHECKOUT=true
+            shift
+            ;;
+        --incremental)
+            INCREMENTAL_ARG="--incremental"
+            PERSISTENT_CHECKOUT=true
+            shift
+            ;;
         --)
             shift
             break
@@ -134,6 +145,12 @@ reporef_dir=/data/reporef
 metadata_dir=/data/metadata
 manifests_dir=/data/manifests
 
+if [ -n "${PERSISTENT_CHECKOUT}" ]; then
+    # Keep the checkout alongside product-metadata on the persistent
+    # metadata volume, so it survives between runs
+    PERSISTENT_CHECKOUT_ARG="--persistent_checkout --checkout_dir ${metadata_dir}/checkouts/${PRODUCT}"
+fi
+
 # Update reporef. Note: This script requires /home/couchbase/reporef
 # to exist in two places, with that exact path:
 #  - The Docker host (currently mega3), so it's persistent
@@ -236,6 +253,13 @@ PYTHONUNBUFFERED=1 find_missing_commits \
     $LAST_MANIFEST_ARG \
     $ONLY_BOUNDARIES_ARG \
     $COMPARE_BUILDS_ARG \
+    $PERSISTENT_CHECKOUT_ARG \
+    $INCREMENTAL_ARG \
+    --state_file ${metadata_dir}/missing-commits-state/${PRODUCT}.json \
+    --cache_file ${metadata_dir}/commit-cache.sqlite \
+    --jira_cache_file ${metadata_dir}/jira-cache.json \
+    --jobs $(nproc) \
+    --timings_file missing-commits-timings.json \
     --manifest_repo ${manifest_repo} \
     --reporef_dir ${reporef_dir} \
     --manifest_dir ${manifest_dir} \
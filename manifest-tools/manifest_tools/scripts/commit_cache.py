@@ -0,0 +1,166 @@
+"""
+Persistent on-disk cache for commit details used by find_missing_commits.
+Commit metadata and diffs never change for a given SHA, so there's no
+need to ask git for them again on every nightly run; entries are keyed
+by (project, sha) and evicted least-recently-used first once the cache
+grows beyond a configured size.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+
+class CommitCache:
+    # SQLite limits the number of bound parameters in a single statement,
+    # so bulk lookups and deletes are done in chunks
+    chunk_size = 500
+
+    def __init__(self, path, max_size=1024 * 1024 * 1024):
+        """
+        path: location of the SQLite database (created if missing)
+        max_size: approximate size in bytes to trim the cache to in evict()
+        """
+
+        self.path = str(path)
+        self.max_size = max_size
+
+        self.lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+
+    @property
+    def conn(self):
+        """
+        Return a connection to the database, opening one if needed. SQLite
+        connections can't be carried across a fork, so each process gets
+        its own
+        """
+
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=60,
+                                   check_same_thread=False)
+            # auto_vacuum only takes effect if set before the table exists;
+            # WAL lets any number of readers work alongside a writer
+            conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            with conn:
+                conn.execute(
+                    'CREATE TABLE IF NOT EXISTS commits ('
+                    ' project TEXT NOT NULL,'
+                    ' sha TEXT NOT NULL,'
+                    ' author TEXT,'
+                    ' author_date TEXT,'
+                    ' commit_date TEXT,'
+                    ' subject TEXT,'
+                    ' diff BLOB,'
+                    ' size INTEGER NOT NULL,'
+                    ' last_used REAL NOT NULL,'
+                    ' PRIMARY KEY (project, sha))'
+                )
+                conn.execute(
+                    'CREATE INDEX IF NOT EXISTS commits_last_used '
+                    'ON commits (last_used)'
+                )
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    def get_many(self, project, shas):
+        """
+        Look up a list of full SHAs for a project, returning a dict of
+        sha -> (author, author_date, commit_date, subject, diff lines)
+        for those which are cached
+        """
+
+        results = {}
+        shas = list(shas)
+        with self.lock:
+            for i in range(0, len(shas), self.chunk_size):
+                chunk = shas[i:i + self.chunk_size]
+                rows = self.conn.execute(
+                    'SELECT sha, author, author_date, commit_date, subject, diff '
+                    'FROM commits WHERE project = ? AND sha IN '
+                    f'({",".join("?" * len(chunk))})',
+                    [project] + chunk
+                ).fetchall()
+                for sha, author, author_date, commit_date, subject, diff in rows:
+                    results[sha] = (author, author_date, commit_date, subject,
+                                    json.loads(zlib.decompress(diff)))
+
+            if results:
+                hits = list(results)
+                now = time.time()
+                with self.conn:
+                    for i in range(0, len(hits), self.chunk_size):
+                        chunk = hits[i:i + self.chunk_size]
+                        self.conn.execute(
+                            'UPDATE commits SET last_used = ? WHERE project = ? '
+                            f'AND sha IN ({",".join("?" * len(chunk))})',
+                            [now, project] + chunk
+                        )
+        return results
+
+    def put_many(self, project, entries):
+        """
+        Store a list of (sha, author, author_date, commit_date, subject,
+        diff lines) tuples for a project
+        """
+
+        now = time.time()
+        rows = []
+        for sha, author, author_date, commit_date, subject, diff in entries:
+            blob = zlib.compress(json.dumps(diff).encode())
+            size = len(blob) + sum(
+                len(field) for field in (author, author_date, commit_date, subject))
+            rows.append((project, sha, author, author_date, commit_date,
+                         subject, blob, size, now))
+
+        if not rows:
+            return
+        with self.lock, self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO commits (project, sha, author, '
+                'author_date, commit_date, subject, diff, size, last_used) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                rows
+            )
+
+    def evict(self):
+        """
+        Drop the least recently used entries until the cache is within
+        max_size, returning the number of entries removed
+        """
+
+        with self.lock:
+            total = self.conn.execute(
+                'SELECT COALESCE(SUM(size), 0) FROM commits').fetchone()[0]
+            if total <= self.max_size:
+                return 0
+
+            doomed = []
+            for rowid, size in self.conn.execute(
+                    'SELECT rowid, size FROM commits ORDER BY last_used'):
+                if total <= self.max_size:
+                    break
+                doomed.append(rowid)
+                total -= size
+
+            with self.conn:
+                for i in range(0, len(doomed), self.chunk_size):
+                    chunk = doomed[i:i + self.chunk_size]
+                    self.conn.execute(
+                        'DELETE FROM commits WHERE rowid IN '
+                        f'({",".join("?" * len(chunk))})',
+                        chunk
+                    )
+            self.conn.execute('PRAGMA incremental_vacuum')
+            return len(doomed)
+
+    def close(self):
+        if self._conn is not None and self._pid == os.getpid():
+            self._conn.close()
+        self._conn = None
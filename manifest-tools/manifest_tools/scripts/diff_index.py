@@ -0,0 +1,48 @@
+"""
+Candidate selection for fuzzy diff matching in find_missing_commits.
+
+fuzz.ratio() on two lists of diff lines is 200 * LCS / (len(a) + len(b)),
+and the longest common subsequence of two lists can never be longer than
+the number of lines they have in common (counting duplicates). An
+inverted index from diff line to the commits containing it lets us work
+out that upper bound for every target commit at once, so only commits
+which could possibly clear the threshold need an exact fuzz.ratio() -
+giving the same matches as comparing against every commit.
+"""
+from collections import Counter, defaultdict
+
+
+class DiffIndex:
+    def __init__(self, diffs):
+        """
+        diffs: list of diffs (each a list of +/- lines); candidates are
+        returned as indexes into this list
+        """
+
+        self.sizes = [len(diff) for diff in diffs]
+        self.empty = [i for i, diff in enumerate(diffs) if not diff]
+        self.postings = defaultdict(list)
+        for i, diff in enumerate(diffs):
+            for line, count in Counter(diff).items():
+                self.postings[line].append((i, count))
+
+    def candidates(self, diff, threshold):
+        """
+        Return the indexes (in their original order) of all indexed diffs
+        whose fuzz.ratio() against diff could exceed threshold
+        """
+
+        if not diff:
+            # Two empty diffs are a perfect match, anything else scores 0
+            return list(self.empty)
+
+        shared = defaultdict(int)
+        for line, count in Counter(diff).items():
+            for i, other_count in self.postings.get(line, ()):
+                shared[i] += min(count, other_count)
+
+        size = len(diff)
+        return sorted(
+            i for i, common in shared.items()
+            if 200 * common >= threshold * (size + self.sizes[i])
+        )
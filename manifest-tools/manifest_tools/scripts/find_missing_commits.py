@@ -8,34 +8,42 @@ The form of the manifest filenames passed is a relative path based
 on their location in the manifest repository (e.g. released/4.6.1.xml).
 """
 import argparse
+import cProfile
 import concurrent.futures
 import contextlib
-import dulwich.patch
+import dulwich.errors
 import dulwich.porcelain
 import dulwich.repo
-import functools
+import hashlib
 import logging
 import os
 import pathlib
-import io
 import json
+import multiprocessing
 import re
 import shutil
 import subprocess
 import sys
 import threading
+import time
 import traceback
-import xml.etree.ElementTree as ET
 
 from collections import defaultdict
-from itertools import combinations
+from itertools import combinations, repeat
 from packaging.version import Version
 from slack_sdk import WebClient
 from slack_sdk.errors import SlackApiError
+from slack_sdk.http_retry.builtin_handlers import RateLimitErrorRetryHandler
 from thefuzz import fuzz
 from time import sleep
 
+from manifest_tools.scripts.commit_cache import CommitCache
+from manifest_tools.scripts.diff_index import DiffIndex
 from manifest_tools.scripts.jira_util import connect_jira, get_tickets
+from manifest_tools.scripts.manifest_model import load_manifest
+from manifest_tools.scripts.run_state import RunState
+from manifest_tools.scripts.ticket_cache import TicketCache
+from manifest_tools.scripts.timings import PhaseTimer, timed
 
 
 slack_oauth_token = os.getenv("SLACK_OAUTH_TOKEN")
@@ -49,6 +57,19 @@ Please review the list below and merge forward as necessary. If any of these are
 """
 
 
+# The MissingCommits instance whose methods are run by map_projects()
+# workers; being forked, they inherit it rather than having it pickled
+_worker_checker = None
+
+
+def _call_checker(method, *args):
+    # Timings are collected per call and handed back to be merged into
+    # the parent's
+    _worker_checker.timings.reset()
+    result = getattr(_worker_checker, method)(*args)
+    return result, _worker_checker.timings.as_dict()
+
+
 def default_dict_factory():
     return defaultdict(default_dict_factory)
 
@@ -84,14 +105,27 @@ class MissingCommits:
     # numeric characters to account for variances in punctuation, spaces etc.
     normalize_regex = re.compile(r'[^a-zA-Z0-9]')
 
+    # Separators used to split up batched 'git log' output; neither should
+    # ever appear in a commit subject or an author's email
+    log_record_separator = '\x1e'
+    log_field_separator = '\x1f'
+    log_format = '%x1e%H%x1f%h%x1f%ae%x1f%ai%x1f%ci%x1f%s'
+
     # Matched commits are categorised, the order here dictates the order they
     # will be shown in when running with DEBUG=true
     match_types = ["Backport", "Date match", "Diff match", "Summary match"]
 
+    # Number of Slack notifications to send at once
+    notify_workers = 8
+
     def __init__(self, logger, product, manifest_dir, manifest_repo,
                  first_manifest, last_manifest, reporef_dir,
                  targeted_projects, debug, show_matches,
-                 only_boundaries, compare_builds, notify):
+                 only_boundaries, compare_builds, notify,
+                 persistent_checkout=False, checkout_dir=None,
+                 cache_file=None, cache_size=None,
+                 jira_cache_file=None, jira_cache_ttl=24, jobs=1,
+                 state_file=None, incremental=False):
         """
         Store key information into instance attributes and determine
         path of 'repo' program
@@ -103,14 +137,18 @@ class MissingCommits:
         self.only_boundaries = only_boundaries
         self.compare_builds = compare_builds
         self.notify = notify
+        self.jobs = jobs
+
+        self.timings = PhaseTimer()
 
         self.sha_lock = threading.Lock()
-        self.date_lock = threading.Lock()
 
         self.matched_commits = 0
 
         self.product = product
-        self.product_dir = pathlib.Path(product)
+        self.product_dir = pathlib.Path(checkout_dir or product)
+        self.persistent_checkout = persistent_checkout
+        self.synced_manifests = set()
         self.manifest_dir = manifest_dir
         self.manifest_repo = manifest_repo
         self.manifest_branch = "main" if product == "sync_gateway" else "master"
@@ -122,7 +160,20 @@ class MissingCommits:
 
         self.commits = default_dict_factory()
         self.long_shas = {}
-        self.commit_authors_and_dates = {}
+        # Linear mode's projects which aren't in the newest manifest
+        self.dropped_projects = {}
+        self.ticket_indexes = {}
+
+        # Optional on-disk cache of commit details, shared between runs
+        self.commit_cache = None
+        if cache_file is not None:
+            self.commit_cache = CommitCache(cache_file)
+            if cache_size is not None:
+                self.commit_cache.max_size = cache_size * 1024 * 1024
+
+        # Results kept for --incremental runs
+        self.run_state = RunState(state_file) if state_file is not None else None
+        self.incremental = incremental and self.run_state is not None
 
         # Projects we don't care about
         self.ignore_projects = [
@@ -132,13 +183,20 @@ class MissingCommits:
         self.repo_bin = shutil.which('repo')
 
         self.slack_client = WebClient(token=slack_oauth_token)
+        # Wait and retry as instructed by Slack's Retry-After header when
+        # notifications are rate limited
+        self.slack_client.retry_handlers.append(
+            RateLimitErrorRetryHandler(max_retry_count=5))
         self.manifests = self.get_manifests(product, self.manifest_dir)
 
         self.notified_users = []
         self.skipped_users = []
 
         # We check jira and ignore tickets which are flagged "is a backport of"
-        # a ticket in the newer release
+        # a ticket in the newer release. Lookups are cached (jira_cache_ttl
+        # is in hours)
+        self.ticket_cache = TicketCache(jira_cache_file,
+                                        ttl=jira_cache_ttl * 60 * 60)
         try:
             self.log.debug("Connecting to Jira")
             self.jira = connect_jira()
@@ -235,21 +293,59 @@ class MissingCommits:
         with open(file_path, "w") as f:
             f.writelines(new_lines)
 
-    def send_alert(self, email, header, body):
+    def send_alert(self, email, header, body, user=None):
+        """
+        Send a direct message to a Slack user, looking up their ID from
+        their email address unless it's given. Returns whether the message
+        was delivered
+        """
+
+        start = time.perf_counter()
         try:
-            user = self.slack_client.users_lookupByEmail(email=email)['user']['id']
+            if user is None:
+                user = self.slack_client.users_lookupByEmail(email=email)['user']['id']
             channel = self.slack_client.conversations_open(users=user)['channel']['id']
             self.slack_client.chat_postMessage(
                 channel=channel,
                 text=header+body
             )
-            if email not in self.notified_users:
-                self.notified_users.append(email)
+            self.log.info(
+                f"Notified {email} in {time.perf_counter() - start:.2f}s")
+            return True
         except SlackApiError as e:
             self.log.error(f"Error: {e.response['error']}")
-            self.log.error(f"Notification for {email} could not be delivered: {body}")
+            self.log.error(f"Notification for {email} could not be delivered "
+                           f"after {time.perf_counter() - start:.2f}s: {body}")
+            return False
+
+    def slack_user_ids(self, emails):
+        """
+        Map email addresses (lower-cased) to Slack user IDs by listing the
+        workspace's users a page at a time, rather than looking up each
+        address separately. Addresses which aren't found are left for
+        send_alert() to look up itself
+        """
+
+        wanted = set(email.lower() for email in emails)
+        user_ids = {}
+        cursor = None
+        try:
+            while True:
+                response = self.slack_client.users_list(limit=1000, cursor=cursor)
+                for member in response['members']:
+                    email = member.get('profile', {}).get('email', '').lower()
+                    if email in wanted and not member.get('deleted'):
+                        user_ids[email] = member['id']
+                cursor = response.get('response_metadata', {}).get('next_cursor')
+                if not cursor or len(user_ids) == len(wanted):
+                    break
+        except SlackApiError as e:
+            self.log.warning(f"Listing Slack users failed ({e.response['error']}), "
+                             "users will be looked up individually")
+        return user_ids
 
     def check_call(self, cmd, cwd=None, stdin=None, stdout=None, stderr=None):
+        self.timings.subprocess()
         self.log.debug(f"check_call: Running {' '.join([str(c) for c in cmd])} in {str(os.getcwd())} with cwd {str(cwd)}")
         subprocess.check_call(
             cmd,
@@ -259,16 +355,21 @@ class MissingCommits:
             stderr=stderr
         )
 
-    def check_output(self, cmd, cwd=None, stdin=None, stderr=None):
+    def check_output(self, cmd, cwd=None, stdin=None, stderr=None, input=None):
+        self.timings.subprocess()
         self.log.debug(f"check_output: Running {' '.join([str(c) for c in cmd])} in {str(os.getcwd())} with cwd {str(cwd)}")
+        # input and stdin are mutually exclusive, so only pass input on
+        # when we actually have some
+        kwargs = {'input': input} if input is not None else {'stdin': stdin}
         return subprocess.check_output(
             cmd,
             cwd=cwd,
-            stdin=stdin,
-            stderr=stderr
+            stderr=stderr,
+            **kwargs
         )
 
     def Popen(self, cmd, cwd=os.getcwd(), stdin=None, stdout=None, stderr=None):
+        self.timings.subprocess()
         self.log.debug(f"popen: Running {' '.join([str(c) for c in cmd])} in {str(os.getcwd())} with cwd {str(cwd)}")
         return subprocess.Popen(
             cmd,
@@ -279,13 +380,8 @@ class MissingCommits:
         )
 
     def get_manifest_annotation(self, manifest, annotation_name):
-        tree = ET.parse(self.manifest_dir / manifest)
-        root = tree.getroot()
-        build = root.find("project[@name='build']")
-        if build:
-            for annotation in build.findall("annotation"):
-                if annotation.get("name") == annotation_name:
-                    return annotation.get("value")
+        return load_manifest(
+            self.manifest_dir / manifest).annotations.get(annotation_name)
 
     def get_manifests(self, product, manifest_dir):
         """
@@ -378,38 +474,18 @@ class MissingCommits:
         else:
             manifest_path = f"{self.product}/.repo/manifests/{self.new_manifest}"
 
-        tree = ET.parse(f"{manifest_path}")
-        root = tree.getroot()
-
-        remotes = {}
-        for remote in root.findall("remote"):
-            name = remote.get('name')
-            fetch = remote.get('fetch')
-            remotes[name] = fetch
-
-        default_remote = None
-        default = root.find("default")
-        if default is not None:
-            default_remote = default.get("remote")
-
-        project = None
-        for p in root.findall("project"):
-            if p.get("name") == project_name:
-                project = p
-                break
-        if project is None:
+        manifest = load_manifest(manifest_path)
+        if project_name not in manifest.projects:
             raise ValueError(
                 f"Project {project_name} not found in {manifest_path}")
 
-        project_remote = project.get("remote") or default_remote
-        if project_remote not in remotes:
+        url = manifest.project_urls[project_name]
+        if url is None:
             raise ValueError(
-                f"Remote {project_remote} not found for project {project_name}")
-
-        fetch_url = remotes[project_remote]
-        url = f"{fetch_url.rstrip('/')}/{project.get('name')}"
+                f"Remote {manifest.projects[project_name]['remote']} not "
+                f"found for project {project_name}")
 
-        return url.replace("ssh://git@", "https://")
+        return url
 
     def get_jira_ticket(self, ticket):
         """
@@ -456,12 +532,13 @@ class MissingCommits:
         # Perform commit diffs, handling merged projects by diffing
         # the merged project against each of the projects the were
         # merged into it
+        project_changes = []
         for repo_path, change_info in changes.items():
             if self.targeted_projects and repo_path.split("/")[-1] not in self.targeted_projects:
                 continue
             if change_info[0] == 'changed':
                 change_info = change_info[1:]
-                self.show_needed_commits(repo_path, change_info)
+                project_changes.append((repo_path, change_info))
             elif change_info[0] == 'added':
                 _, new_commit, new_diff = change_info
                 for pre in self.merge_map[repo_path]:
@@ -470,46 +547,405 @@ class MissingCommits:
                     if old_commit is not None:
                         change_info = (old_commit, new_commit,
                                        old_diff, new_diff)
-                        self.show_needed_commits(repo_path, change_info)
+                        project_changes.append((repo_path, change_info))
+
+        # With --incremental, projects which compared the same SHAs last
+        # time (with the same ignored commits and Jira links) have their
+        # stored results recorded again rather than being recomputed
+        stored = {}
+        if self.incremental:
+            for repo_path, change_info in project_changes:
+                if self.skip_project(repo_path):
+                    continue
+                shas = [self.get_long_sha(repo_path, sha) for sha in change_info[:2]]
+                entry = self.stored_result(old_manifest, new_manifest,
+                                           repo_path, shas, self.ignored_commits)
+                if entry is not None:
+                    stored[repo_path] = entry
+            stored = self.check_stored_backports(stored)
+
+        project_commits = [
+            commits for commits in self.map_projects(
+                'collect_commits',
+                [repo_path for repo_path, _ in project_changes
+                 if repo_path not in stored],
+                [change_info for repo_path, change_info in project_changes
+                 if repo_path not in stored])
+            if commits
+        ]
+
+        # Look up the Jira tickets of every potentially missing commit in
+        # this pair up front, rather than one at a time
+        self.prefetch_backports(
+            ticket
+            for commits in project_commits
+            for sha, message, _, _, _, _ in commits["source_only"]
+            if not self.is_ignored(sha)
+            for ticket in get_tickets(message)
+        )
+
+        # Matching runs in the workers, but results are recorded here in
+        # project order so the output doesn't depend on scheduling
+        outcomes = self.map_projects('classify_commits', project_commits)
+        results = {}
+        for commits, project_outcomes in zip(project_commits, outcomes):
+            self.store_result(old_manifest, new_manifest, commits,
+                              project_outcomes, self.ignored_commits)
+            results[commits["repo_path"]] = (commits, project_outcomes)
+
+        for repo_path, _ in project_changes:
+            if repo_path in stored:
+                self.show_needed_commits(*self.restore_result(
+                    old_manifest, new_manifest, stored[repo_path]))
+            elif repo_path in results:
+                self.show_needed_commits(*results[repo_path])
+
+    def identify_missing_commits_linear(self):
+        """
+        Equivalent to calling identify_missing_commits() for every pair of
+        active manifests, but rather than syncing and diffing each pair,
+        every manifest is synced once and each project's history is walked
+        once from all of its manifests' SHAs (see collect_linear). Projects
+        dropped from the newest manifest have no working tree once it's
+        synced, so they're read from the git directories repo keeps for
+        them (see project_dir()). Results are recorded in the same order
+        as the pairwise comparison, so the output is the same
+        """
+
+        manifests = self.manifests
+        self.log.info(
+            f"Checking for missing commits across {', '.join(manifests)}")
+
+        revisions = []
+        projects = {}
+        for manifest in manifests:
+            self.new_manifest = manifest
+            self.repo_sync()
+            revisions.append(self.manifest_revisions('new.xml'))
+            projects.update(load_manifest('new.xml').paths)
+        self.dropped_projects = {
+            repo_path: project for repo_path, project in projects.items()
+            if repo_path not in revisions[-1]
+        }
+
+        # The ignored commits file depends on the newer manifest of a pair
+        self.linear_ignored_commits = {}
+        for j, manifest in enumerate(manifests[1:], 1):
+            self.new_manifest = manifest
+            self.linear_ignored_commits[j] = self.get_ignored_commits()
+
+        repo_paths = sorted(
+            repo_path
+            for repo_path in set().union(*revisions)
+            if not self.targeted_projects
+            or repo_path.split("/")[-1] in self.targeted_projects
+        )
+
+        # With --incremental, a project is only walked again if any of its
+        # manifest pairs can't reuse the stored result
+        stored = {}
+        if self.incremental:
+            for repo_path in repo_paths:
+                if self.skip_project(repo_path) \
+                        or not self.project_dir(repo_path).is_dir():
+                    continue
+                shas = [
+                    self.get_long_sha(repo_path, revision[repo_path])
+                    if revision.get(repo_path) else None
+                    for revision in revisions
+                ]
+                entries = {
+                    (i, j): self.stored_result(
+                        manifests[i], manifests[j], repo_path,
+                        [shas[i], shas[j]], self.linear_ignored_commits[j])
+                    for i, j in self.changed_pairs(shas)
+                }
+                if entries and None not in entries.values():
+                    for pair, entry in entries.items():
+                        stored[(repo_path, pair)] = entry
+            valid = self.check_stored_backports(stored)
+            # A project's pairs are either all reused or all redone
+            invalid_paths = set(
+                repo_path for repo_path, _ in stored.keys() - valid.keys())
+            stored = {
+                key: entry for key, entry in valid.items()
+                if key[0] not in invalid_paths
+            }
+
+        stored_paths = set(repo_path for repo_path, _ in stored)
+        changed_paths = [
+            repo_path for repo_path in repo_paths
+            if repo_path not in stored_paths
+        ]
+        changed_pairs = dict(zip(changed_paths, self.map_projects(
+            'collect_linear', changed_paths,
+            [[revision.get(repo_path) for revision in revisions]
+             for repo_path in changed_paths])))
+
+        tickets = []
+        for pairs in changed_pairs.values():
+            for (_, j), commits in pairs:
+                self.ignored_commits = self.linear_ignored_commits[j]
+                tickets.extend(
+                    ticket
+                    for sha, message, _, _, _, _ in commits["source_only"]
+                    if not self.is_ignored(sha)
+                    for ticket in get_tickets(message)
+                )
+        self.prefetch_backports(tickets)
+
+        outcomes = self.map_projects(
+            'classify_linear', list(changed_pairs.values()))
+
+        results = []
+        for (repo_path, pairs), project_outcomes in zip(
+                changed_pairs.items(), outcomes):
+            for ((i, j), commits), pair_outcomes in zip(pairs, project_outcomes):
+                self.store_result(manifests[i], manifests[j], commits,
+                                  pair_outcomes, self.linear_ignored_commits[j])
+                results.append(((i, j), repo_path, commits, pair_outcomes))
+        for (repo_path, (i, j)), entry in stored.items():
+            results.append(((i, j), repo_path, *self.restore_result(
+                manifests[i], manifests[j], entry)))
+
+        # identify_missing_commits() handles one pair at a time, in the
+        # order given by combinations(), and 'repo diffmanifests' lists
+        # projects by path; replay the results the same way
+        results.sort(key=lambda result: result[:2])
+        for (i, j), _, commits, pair_outcomes in results:
+            self.old_manifest = manifests[i]
+            self.new_manifest = manifests[j]
+            self.ignored_commits = self.linear_ignored_commits[j]
+            self.show_needed_commits(commits, pair_outcomes)
+
+    @staticmethod
+    def ignored_digest(ignored_commits):
+        return hashlib.sha1(
+            '\n'.join(sorted(ignored_commits)).encode()).hexdigest()
+
+    def stored_result(self, old_manifest, new_manifest, repo_path, shas,
+                      ignored_commits):
+        """
+        Return the result stored by an earlier run for a project in a
+        manifest pair, provided it compared the same SHAs with the same
+        ignored commits; otherwise None
+        """
+
+        if not self.incremental:
+            return None
+
+        entry = self.run_state.get(old_manifest, new_manifest, repo_path)
+        if entry is None or entry["shas"] != list(shas) \
+                or entry["ignored"] != self.ignored_digest(ignored_commits):
+            return None
+        return entry
+
+    def check_stored_backports(self, stored):
+        """
+        Given a dict of stored results, return those for which Jira still
+        gives the same backport links as when they were stored
+        """
+
+        self.prefetch_backports(
+            ticket for entry in stored.values() for ticket in entry["tickets"])
+        return {
+            key: entry for key, entry in stored.items()
+            if all(self.backports_of([ticket]) == backports
+                   for ticket, backports in entry["tickets"].items())
+        }
+
+    def store_result(self, old_manifest, new_manifest, project_commits,
+                     outcomes, ignored_commits):
+        """
+        Save a project's commits and their classification for a manifest
+        pair, so a later --incremental run can reuse them. Diffs aren't
+        needed to record a result, so they're dropped, as are target-only
+        commits nothing was matched against
+        """
+
+        if self.run_state is None:
+            return
+
+        def strip(commit):
+            return list(commit[:5]) + [[]]
+
+        indexed = [
+            match_type not in (None, "Ignored", "Backport")
+            for match_type, _ in outcomes
+        ]
+        referenced = sorted(set(
+            details[0] for (_, details), has_index in zip(outcomes, indexed)
+            if has_index
+        ))
+        new_index = {i: n for n, i in enumerate(referenced)}
+
+        self.run_state.put(old_manifest, new_manifest, project_commits["repo_path"], {
+            "shas": [project_commits["source_sha"], project_commits["target_sha"]],
+            "ignored": self.ignored_digest(ignored_commits),
+            "tickets": {
+                ticket: self.backports_of([ticket])
+                for commit, (match_type, _) in zip(
+                    project_commits["source_only"], outcomes)
+                if match_type != "Ignored"
+                for ticket in get_tickets(commit[1])
+            },
+            "commits": {
+                "repo_path": project_commits["repo_path"],
+                "source_sha": project_commits["source_sha"],
+                "target_sha": project_commits["target_sha"],
+                "source_only": [
+                    strip(commit) for commit in project_commits["source_only"]],
+                "target_only": [
+                    strip(project_commits["target_only"][i]) for i in referenced],
+            },
+            "outcomes": [
+                (match_type, (new_index[details[0]], details[1]) if has_index else details)
+                for (match_type, details), has_index in zip(outcomes, indexed)
+            ],
+        })
+
+    def restore_result(self, old_manifest, new_manifest, entry):
+        """
+        Return the (project commits, outcomes) of a stored result, ready
+        for show_needed_commits()
+        """
+
+        repo_path = entry["commits"]["repo_path"]
+        self.run_state.keep(old_manifest, new_manifest, repo_path)
+        commits = dict(entry["commits"],
+                       project_name=self.get_project_name(repo_path))
+        return commits, entry["outcomes"]
+
+    def map_projects(self, method, *iterables):
+        """
+        Call the named method for each set of arguments taken from
+        iterables, returning the results in order. With more than one job
+        the calls are spread across a pool of forked worker processes:
+        these inherit this object's state as it is at the time of the call,
+        but any changes they make to it are not seen here (apart from
+        timings, which are merged back in)
+        """
+
+        if self.jobs <= 1:
+            return list(map(getattr(self, method), *iterables))
+
+        global _worker_checker
+        _worker_checker = self
+        # Don't hand an open database connection to the children
+        if self.commit_cache is not None:
+            self.commit_cache.close()
+
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.jobs,
+                mp_context=multiprocessing.get_context('fork')) as executor:
+            results = []
+            for result, timings in executor.map(
+                    _call_checker, repeat(method), *iterables):
+                self.timings.merge(timings)
+                results.append(result)
+            return results
+
+    @staticmethod
+    def backport_links(issuelinks):
+        """
+        Return the keys of the tickets an issue's links flag it as "is a
+        backport of"
+        """
+        return [
+            issuelink["outwardIssue"]["key"] for issuelink in issuelinks
+            # Ensure we're looking at the actual backport ticket, not a
+            # ticket that was itself backported
+            if issuelink["type"]["outward"] == "is a backport of"
+            and "outwardIssue" in issuelink
+        ]
+
+    @timed('prefetch_backports')
+    def prefetch_backports(self, tickets, batch_size=50):
+        """
+        Resolve the backport links of a collection of tickets using batched
+        'key in (...)' searches which only request the issuelinks field,
+        storing the results in the ticket cache so backports_of() rarely
+        has to go to Jira itself
+        """
+
+        missing = self.ticket_cache.missing(tickets)
+        for i in range(0, len(missing), batch_size):
+            batch = missing[i:i + batch_size]
+            try:
+                self.log.debug(f"Fetching {len(batch)} Jira tickets")
+                # Without query validation, keys which don't exist (e.g.
+                # "UTF-8" in a commit message) are ignored rather than
+                # failing the whole search
+                issues = self.jira.search_issues(
+                    f'key in ({",".join(batch)})', fields='issuelinks',
+                    maxResults=len(batch), validate_query=False)
+            except Exception:
+                traceback.print_exc()
+                self.log.warning(
+                    f"Batched Jira search failed for {', '.join(batch)}, "
+                    "these will be fetched individually")
+                continue
 
+            for issue in issues:
+                self.ticket_cache.put(
+                    issue.key,
+                    self.backport_links(issue.raw["fields"]["issuelinks"]))
+
+        # Anything not returned (e.g. tickets moved to another project)
+        # has to be fetched by key; do that here rather than leaving it to
+        # backports_of(), which may be running in a worker process
+        for ticket in self.ticket_cache.missing(missing):
+            self.fetch_backports(ticket)
+
+    def fetch_backports(self, ticket, retries=3):
+        """
+        Fetch a single ticket from Jira and return the tickets it is
+        flagged "is a backport of", caching the result
+        """
+
+        for _ in range(retries):
+            try:
+                jira_ticket = self.get_jira_ticket(ticket)
+                # Connection failures don't seem to raise an error, so we
+                # just check if jira_ticket came back ok and retry if not
+                if not jira_ticket:
+                    sleep(1)
+                    continue
+                backports = self.backport_links(
+                    jira_ticket.raw["fields"]["issuelinks"])
+                self.ticket_cache.put(ticket, backports)
+                return backports
+            except Exception as exc:
+                if getattr(exc.__cause__, "status_code", None) == 404:
+                    # Not a real ticket, no point asking again
+                    self.ticket_cache.put(ticket, [])
+                    return []
+                self.log.error(
+                    f"Jira ticket retrieval failed for {ticket}")
+
+        # If we got here, we ran out of retries
+        self.log.error(f"Jira ticket retrieval failed for {ticket}")
+        return []
+
+    @timed('backports_of')
     def backports_of(self, tickets, retries=3):
         """
         For a list of tickets, gather any outward links flagged "is a
         backport of" in Jira and return a combined listing of the ticket
-        references
+        references. Tickets resolved by prefetch_backports() (or an earlier
+        run, if the ticket cache is persisted) don't need a Jira request
         """
 
         backports = []
         for ticket in tickets:
-            for _ in range(retries):
-                try:
-                    jira_ticket = self.get_jira_ticket(ticket)
-                    # Connection failures don't seem to raise an error, so we just
-                    # check if jira_ticket came back ok and retry 3 times if not
-                    # before giving up
-                    if not jira_ticket:
-                        sleep(1)
-                        return self.backports_of(tickets, retries-1)
-                    for issuelink in jira_ticket.raw["fields"]["issuelinks"]:
-                        if issuelink["type"]["outward"] == "is a backport of":
-                            # Ensure we're looking at the actual backport ticket,
-                            # not a ticket that was itself backported
-                            if "outwardIssue" in issuelink:
-                                backports.append(
-                                    issuelink["outwardIssue"]["key"])
-                    # If we got here we can break out of the retry loop and
-                    # move on to the next ticket
-                    break
-                except Exception as exc:
-                    self.log.error(
-                        f"Jira ticket retrieval failed for {ticket}")
-            else:
-                # If we got here, we ran out of retries without hitting the
-                # break
-                self.log.error(f"Jira ticket retrieval failed for {ticket}")
+            ticket_backports = self.ticket_cache.get(ticket)
+            if ticket_backports is None:
+                ticket_backports = self.fetch_backports(ticket, retries)
+            backports.extend(ticket_backports)
 
         return backports
 
+    @timed('repo_sync')
     def repo_sync(self):
         """
         Initialize and sync a repo checkout based on the target
@@ -518,6 +954,16 @@ class MissingCommits:
         'repo manifest -r' so 'git log' will work properly
         """
 
+        if self.persistent_checkout:
+            try:
+                self.persistent_repo_sync()
+                return
+            except RuntimeError:
+                self.log.warning(
+                    f'Refreshing persistent checkout "{self.product_dir}" '
+                    'failed, falling back to a fresh sync')
+                self.synced_manifests.clear()
+
         self.repo_bin = shutil.which('repo')
         # Create a 'product' directory to contain the repo checkout
         if self.product_dir.exists():
@@ -535,6 +981,84 @@ class MissingCommits:
                 ) from exc
         self.product_dir.mkdir(parents=True, exist_ok=True)
 
+        self.repo_init()
+        self.repo_sync_projects()
+
+        # This is needed for manifests with projects not locked down
+        # (e.g. spock.xml)
+        self.repo_manifest('new.xml')
+
+    def persistent_repo_sync(self):
+        """
+        Refresh a checkout which is kept between manifest pairs (and
+        between runs) rather than wiping and recreating it. Each manifest
+        is only synced once per run: the resulting 'repo manifest -r'
+        output is kept under .repo/pinned-manifests and every project's
+        revision is pinned with 'git update-ref', so subsequent pairs
+        using the same manifest only need a local diff
+        """
+
+        pinned_manifest = self.pinned_manifest_path(self.new_manifest)
+
+        if self.new_manifest in self.synced_manifests:
+            self.log.debug(f'Reusing pinned manifest {pinned_manifest}')
+            shutil.copyfile(pinned_manifest, 'new.xml')
+            return
+
+        self.product_dir.mkdir(parents=True, exist_ok=True)
+        self.repo_bin = shutil.which('repo')
+
+        # 'repo init' in an existing checkout just switches the manifest,
+        # and 'repo sync' then only fetches what has changed and updates
+        # the working trees in place
+        self.repo_init()
+        self.repo_sync_projects(['--detach'])
+
+        pinned_manifest.parent.mkdir(parents=True, exist_ok=True)
+        self.repo_manifest(pinned_manifest)
+
+        # Keep each manifest's revisions reachable, so a later fetch or
+        # gc can't discard objects needed to diff against it
+        try:
+            self.check_output(
+                [self.repo_bin, 'forall', '-j', '8', '-c',
+                 f'git update-ref {self.pinned_ref(self.new_manifest)} HEAD'],
+                cwd=self.product_dir, stderr=subprocess.STDOUT
+            )
+        except subprocess.CalledProcessError as exc:
+            traceback.print_exc()
+            raise RuntimeError(
+                f'The "repo forall" command failed: {exc.output}') from exc
+
+        shutil.copyfile(pinned_manifest, 'new.xml')
+        self.synced_manifests.add(self.new_manifest)
+
+    @staticmethod
+    def manifest_slug(manifest):
+        """
+        Turn a manifest path into something usable as a file or ref name
+        """
+        return re.sub(r'[^A-Za-z0-9._-]', '_', str(manifest))
+
+    def pinned_manifest_path(self, manifest):
+        """
+        Location of the 'repo manifest -r' output for a given manifest
+        in a persistent checkout
+        """
+        return (self.product_dir / '.repo' / 'pinned-manifests'
+                / self.manifest_slug(manifest)).resolve()
+
+    def pinned_ref(self, manifest):
+        """
+        Ref used to pin a manifest's revision in each project
+        """
+        return f'refs/missing-commits/{self.manifest_slug(manifest)}'
+
+    def repo_init(self):
+        """
+        Run 'repo init' for the target manifest in the product directory
+        """
+
         try:
             cmd = [self.repo_bin, 'init', '-u',
                    self.manifest_dir,
@@ -558,9 +1082,14 @@ class MissingCommits:
         # cwd=self.product_dir, so this relative path will work.
         self.repo_bin = os.path.join(".repo", "repo", "repo")
 
+    def repo_sync_projects(self, extra_args=None):
+        """
+        Run 'repo sync' in the product directory
+        """
+
         try:
             cmd = [self.repo_bin, 'sync',
-                    f'--jobs=8', '--force-sync']
+                    f'--jobs=8', '--force-sync'] + (extra_args or [])
             self.check_output(
                 cmd,
                 cwd=self.product_dir, stderr=subprocess.STDOUT
@@ -570,10 +1099,14 @@ class MissingCommits:
             raise RuntimeError(
                 f'The "repo sync" command failed: {exc.output}') from exc
 
-        # This is needed for manifests with projects not locked down
-        # (e.g. spock.xml)
+    def repo_manifest(self, output_file):
+        """
+        Write the current checkout's manifest, with all revisions
+        resolved to SHAs, to output_file
+        """
+
         try:
-            with open('new.xml', 'w') as fh:
+            with open(output_file, 'w') as fh:
                 self.check_call(
                     [self.repo_bin, 'manifest', '-r'],
                     stdout=fh, cwd=self.product_dir
@@ -583,6 +1116,17 @@ class MissingCommits:
             raise RuntimeError(
                 f'The "repo manifest -r" command failed: {exc.output}') from exc
 
+    @staticmethod
+    def manifest_revisions(manifest_file):
+        """
+        Return a dict of project path -> revision for a manifest
+        """
+        return {
+            path: project["revision"]
+            for path, project in load_manifest(manifest_file).paths.items()
+        }
+
+    @timed('diff_manifests')
     def diff_manifests(self):
         """
         Generate the diffs between the two manifests via the command
@@ -608,132 +1152,246 @@ class MissingCommits:
             if not line.startswith(' ')
         ]
 
-    def get_author_and_dates(self, repo_path, commit_sha):
+    def get_range_commits(self, repo_path, commit_range):
         """
-        Get the author date for a specific SHA
+        Retrieve the details of every commit in the right-hand side of a
+        symmetric difference (e.g. 'A...B'), as a list of tuples:
+            (short sha, subject, author, author date, commit date, diff)
         """
+        return self.get_commits(
+            repo_path,
+            ['--cherry-pick', '--right-only', '--no-merges', commit_range])
 
-        with self.date_lock:
-            if commit_sha in self.commit_authors_and_dates:
-                return self.commit_authors_and_dates[commit_sha]
+    @timed('get_commits')
+    def get_commits(self, repo_path, log_args, input=None):
+        """
+        Retrieve the details of the commits selected by a set of 'git log'
+        arguments (and optionally revisions passed on stdin), in the same
+        form as get_range_commits(). Metadata for all the commits comes
+        from a single 'git log', and the diffs from a single 'git log -p'
+        (see get_diffs)
+        """
 
-        project_dir = self.product_dir / repo_path
+        project_dir = self.project_dir(repo_path)
         try:
-            (author, author_date, commit_date) = self.check_output(
-                ['git', 'show', '-s', '--format=%ae|%ai|%ci', commit_sha],
-                cwd=project_dir
-            ).decode().strip().split("|")
-            self.commit_authors_and_dates[commit_sha] = (author, author_date, commit_date)
-            return (author, author_date, commit_date)
+            output = self.check_output(
+                [self.git_bin, 'log', f'--format={self.log_format}'] + log_args,
+                cwd=project_dir, stderr=subprocess.STDOUT, input=input
+            ).decode(errors='replace')
         except subprocess.CalledProcessError as exc:
             traceback.print_exc()
-            raise RuntimeError(
-                f'Failed to retrieve author and commit dates for '
-                f'{commit_sha}: {exc.output}') from exc
+            raise RuntimeError(f'The "git log" command for project "{repo_path}" '
+                               f'failed: {exc.stdout}') from exc
 
-    def get_commit_details(self, line, repo_path):
-        """
-        Retrieves the commit details for a given line of git output
-        (a sha followed by the subject line of that sha)
-        """
-        sha, msg = line.split(' ', 1)
-        long_sha = self.get_long_sha(repo_path, sha)
-        author, author_date, commit_date = self.get_author_and_dates(repo_path, long_sha)
-        diff_changes = self.get_diff_changes(repo_path, long_sha)
-        return (sha, msg, author, author_date, commit_date, diff_changes)
+        entries = []
+        for record in output.split(self.log_record_separator)[1:]:
+            long_sha, sha, author, author_date, commit_date, msg = \
+                record.rstrip('\n').split(self.log_field_separator, 5)
+            with self.sha_lock:
+                self.long_shas[f"{repo_path}:{sha[:7]}"] = long_sha
+            entries.append(
+                (long_sha, sha, msg, author, author_date, commit_date))
+
+        long_shas = [entry[0] for entry in entries]
+        if self.commit_cache is not None:
+            cached = self.commit_cache.get_many(repo_path, long_shas)
+            diffs = {sha: details[-1] for sha, details in cached.items()}
+            uncached = [sha for sha in long_shas if sha not in cached]
+            if uncached:
+                diffs.update(self.get_diffs(repo_path, uncached))
+                self.commit_cache.put_many(repo_path, [
+                    (long_sha, author, author_date, commit_date, msg, diffs[long_sha])
+                    for long_sha, _, msg, author, author_date, commit_date in entries
+                    if long_sha not in cached
+                ])
+        else:
+            diffs = self.get_diffs(repo_path, long_shas)
 
-    def get_diff_changes(self, repo_path, commit_sha):
+        return [
+            (sha, msg, author, author_date, commit_date, diffs.get(long_sha, []))
+            for long_sha, sha, msg, author, author_date, commit_date in entries
+        ]
+
+    @timed('get_diffs')
+    def get_diffs(self, repo_path, long_shas):
         """
-        Retrieve a diff for a given sha showing only added/removed lines
+        Retrieve the diffs (added/removed lines only) for a list of full
+        SHAs via one 'git log -p' invocation, returning a dict keyed by SHA.
+        Diffs are against the first parent, without rename detection,
+        and root commits get no diff
         """
 
-        project_dir = self.product_dir / repo_path
-        repo = dulwich.repo.Repo(str(project_dir.resolve()))
+        if not long_shas:
+            return {}
 
-        # Make sure we're working with the full sha, or the lookup below
-        # will throw an error
-        commit_sha = self.get_long_sha(repo_path, commit_sha)
-
-        obj = repo[bytes(commit_sha, 'utf-8')]
+        project_dir = self.project_dir(repo_path)
+        try:
+            output = self.check_output(
+                [self.git_bin, 'log', '-p', '--no-walk=unsorted', '--stdin',
+                 '--no-renames', '--no-color', '--no-ext-diff',
+                 f'--format={self.log_record_separator}%H{self.log_field_separator}%P'],
+                cwd=project_dir, stderr=subprocess.STDOUT,
+                input='\n'.join(long_shas).encode()
+            ).decode(errors='replace')
+        except subprocess.CalledProcessError as exc:
+            traceback.print_exc()
+            raise RuntimeError(f'The "git log -p" command for project "{repo_path}" '
+                               f'failed: {exc.stdout}') from exc
 
-        if isinstance(obj, dulwich.objects.Tag):
-            commit = repo[obj.object[1]]
-        else:
-            commit = obj
+        diffs = {}
+        for record in output.split(self.log_record_separator)[1:]:
+            header, _, patch = record.partition('\n')
+            long_sha, parents = header.split(self.log_field_separator, 1)
+            if not parents.strip():
+                self.log.error(f"No parents on {long_sha} in {repo_path}")
+                diffs[long_sha] = []
+                continue
+            diffs[long_sha] = [
+                line for line in patch.split('\n')
+                if line and line.startswith(('+', '-'))
+            ]
+        return diffs
 
-        if not isinstance(commit, dulwich.objects.Commit):
-            self.log.error(
-                f'The object resolved from SHA {commit_sha} in {repo_path} is '
-                'not a commit.')
-            return []
+    @timed('get_patch_ids')
+    def get_patch_ids(self, repo_path, long_shas):
+        """
+        Return a dict mapping full SHAs to their patch IDs, which is what
+        'git log --cherry-pick' uses to recognise commits making the same
+        change. Commits with an empty diff have no patch ID
+        """
 
-        if not commit.parents:
-            self.log.error(f"No parents on {commit_sha} in {repo_path}")
-            return []
+        if not long_shas:
+            return {}
 
-        prev_commit = repo[commit.parents[0]]
+        project_dir = self.project_dir(repo_path)
+        try:
+            patches = self.check_output(
+                [self.git_bin, 'log', '-p', '--no-walk=unsorted', '--stdin',
+                 '--no-color', '--no-ext-diff', '--format=commit %H'],
+                cwd=project_dir, stderr=subprocess.STDOUT,
+                input='\n'.join(long_shas).encode()
+            )
+            output = self.check_output(
+                [self.git_bin, 'patch-id'],
+                cwd=project_dir, stderr=subprocess.STDOUT, input=patches
+            ).decode()
+        except subprocess.CalledProcessError as exc:
+            traceback.print_exc()
+            raise RuntimeError(f'Computing patch IDs for project "{repo_path}" '
+                               f'failed: {exc.stdout}') from exc
 
-        fh = io.BytesIO()
-        dulwich.patch.write_tree_diff(fh, repo.object_store, prev_commit.tree,
-                                      commit.tree)
-
-        return [
-            line for line in fh.getvalue().decode(errors='replace').split('\n')
-            if line and line.startswith(('+', '-'))
-        ]
+        patch_ids = {}
+        for line in output.splitlines():
+            patch_id, long_sha = line.split()
+            patch_ids[long_sha] = patch_id
+        return patch_ids
 
     def get_long_sha(self, project, commit):
         """
         Find the full SHA from a specified branch/tag/SHA
         """
 
+        # SHAs are cached by their first 7 characters (as get_commits()
+        # stores them), anything else by its full name - branches such as
+        # release/7.2 and release/7.6 would otherwise collide
+        if MissingCommits.long_sha_regex.fullmatch(commit) is not None \
+                or MissingCommits.short_sha_regex.fullmatch(commit) is not None:
+            key = f"{project}:{commit[:7]}"
+        else:
+            key = f"{project}:{commit}"
+
         # In cache? Just return it
         with self.sha_lock:
-            if f"{project}:{commit[:7]}" in self.long_shas:
-                return self.long_shas[f"{project}:{commit[:7]}"]
+            if key in self.long_shas:
+                return self.long_shas[key]
 
         # Long sha? cache and return
         if MissingCommits.long_sha_regex.fullmatch(commit) is not None:
-            self.long_shas[f"{project}:{commit[:7]}"] = commit
+            self.long_shas[key] = commit
             return commit
 
-        # Not a long SHA, so ask git to turn it into one. If 'commit'
-        # looks like a short sha, use rev-parse, if it looks like a tag
-        # reference, use it directly with show-ref; otherwise, assume it's
-        # a branch name, prepend the remote name to disambiguate and use
-        # show-ref
+        # Not a long SHA, so turn it into one. If 'commit' looks like a
+        # short sha, leave it to rev-parse, if it looks like a tag
+        # reference, use it directly; otherwise, assume it's a branch
+        # name and look it up under the project's remote to disambiguate
         if MissingCommits.short_sha_regex.fullmatch(commit) is not None:
-            cmd = "git rev-parse"
             git_ref = commit
         elif MissingCommits.tag_regex.fullmatch(commit) is not None:
-            cmd = "git show-ref --hash"
             git_ref = commit
         else:
-            # $REPO_REMOTE is set by 'repo forall'
-            cmd = "git show-ref --hash"
-            git_ref = f'$REPO_REMOTE/{commit}'
+            checkout_project = self.checkout_project(project)
+            if checkout_project is None:
+                raise RuntimeError(
+                    f'Project {project} not found in the current checkout')
+            git_ref = f'refs/remotes/{checkout_project["remote"]}/{commit}'
+
+        commit_sha = self.resolve_ref(project, git_ref)
+
+        self.long_shas[key] = commit_sha
+        return commit_sha
+
+    def resolve_ref(self, project, git_ref):
+        """
+        Return the SHA a ref (or short SHA) points to in a project. Refs
+        are read directly (loose or packed) with dulwich, anything else is
+        handed to 'git rev-parse'
+        """
+
+        project_dir = self.project_dir(project)
+        if git_ref.startswith('refs/'):
+            try:
+                repo = dulwich.repo.Repo(str(project_dir.resolve()))
+                return repo.refs[git_ref.encode()].decode()
+            except (KeyError, dulwich.errors.NotGitRepository):
+                pass
 
         try:
-            commit_sha = self.check_output(
-                [self.repo_bin, 'forall', project, '-c',
-                 f'{cmd} {git_ref}'],
-                cwd=self.product_dir, stderr=subprocess.STDOUT
+            return self.check_output(
+                [self.git_bin, 'rev-parse', '--verify', '--quiet', git_ref],
+                cwd=project_dir
             ).decode().strip()
         except subprocess.CalledProcessError as exc:
             traceback.print_exc()
             raise RuntimeError(
-                f'The "repo forall" command failed: {exc.output}') from exc
+                f'Unable to resolve {git_ref} in {project}') from exc
 
-        self.long_shas[f"{project}:{commit[:7]}"] = commit_sha
-        return commit_sha
+    def checkout_project(self, repo_path):
+        """
+        Return a dict with the name and remote of a project in the current
+        checkout (as described by new.xml), or a project dropped from it
+        in linear mode, or None if there's no such project
+        """
+        project = load_manifest('new.xml').paths.get(repo_path)
+        if project is None:
+            project = self.dropped_projects.get(repo_path)
+        return project
+
+    def project_dir(self, repo_path):
+        """
+        Return the directory to run git in for a project: its working
+        tree or, if the current checkout doesn't include it (as with a
+        project dropped from the newest manifest in linear mode), the git
+        directory repo keeps under .repo/projects after removing the
+        working tree
+        """
+
+        project_dir = self.product_dir / repo_path
+        if not project_dir.is_dir():
+            git_dir = self.product_dir / '.repo' / 'projects' / f'{repo_path}.git'
+            if git_dir.is_dir():
+                return git_dir
+        return project_dir
+
+    def get_project_name(self, repo_path):
+        """
+        Return the name of the project at a path in the current checkout
+        """
 
-    def get_project_name(self, project_dir):
-        project_name = self.check_output(
-            [self.repo_bin, 'forall', project_dir, '-c',
-                f'echo $REPO_PROJECT'],
-            cwd=self.product_dir, stderr=subprocess.STDOUT
-        ).decode().strip()
-        return project_name
+        project = self.checkout_project(repo_path)
+        if project is None:
+            raise RuntimeError(
+                f'No project at path "{repo_path}" in the current checkout')
+        return project["name"]
 
     def _mark_commit_status(self, project, sha, present_in=None, missing_from=None):
         """
@@ -778,52 +1436,88 @@ class MissingCommits:
 
         self.matched_commits += 1
 
-    def match_date(self, project, new_commit, old_commits):
+    @classmethod
+    def normalize_summary(cls, message):
         """
-        Checks if the date of a new commit matches the date of any old commit
-        in a list of old commits.
+        Reduce a commit summary to a form suitable for comparing against
+        other summaries, ignoring punctuation, spacing and case
         """
+        return re.sub(cls.backport_regex, '', re.sub(
+            cls.normalize_regex, '', message)).lower()
 
-        new_sha, new_commit_message, new_author, new_author_date, _, _ = new_commit
-        for old_sha, old_commit_message, old_author, old_author_date, _, _ in old_commits:
-            if old_author_date == new_author_date and old_author == new_author:
-                self.add_match("Date match", project, old_author, old_sha,
-                               old_commit_message, new_sha, new_commit_message)
-                return True
+    def index_target_commits(self, target_only_commits):
+        """
+        Build lookup tables over a project's target-only commits, so each
+        potentially missing commit can be matched without rescanning them:
+          - summary: normalized summary -> index of first such commit
+          - date: (author, author date) -> index of first such commit
+          - diff: a DiffIndex of the commits' diffs
+        """
 
-    def match_diff(self, project, new_commit, old_commits):
+        by_summary = {}
+        by_author_date = {}
+        for i, (_, message, author, author_date, _, _) in enumerate(target_only_commits):
+            if len(message) > 10:
+                by_summary.setdefault(self.normalize_summary(message), i)
+            by_author_date.setdefault((author, author_date), i)
+
+        return {
+            "commits": target_only_commits,
+            "summary": by_summary,
+            "date": by_author_date,
+            "diff": DiffIndex([commit[5] for commit in target_only_commits]),
+        }
+
+    @timed('match_date')
+    def match_date(self, new_commit, target_index):
         """
-        Fuzzy comparison of two diffs (changes only)
+        Checks if the author and author date of a new commit match those of
+        any of the indexed target-only commits, returning (index of the
+        matching commit, None) if so.
         """
 
-        new_sha, new_commit_message, _, _, _, new_diff = new_commit
-        for old_sha, old_commit_message, old_author, _, _, old_diff in old_commits:
-            if len(new_diff) <= 10:
-                threshold = 90
-            elif len(new_diff) <= 50:
-                threshold = 80
-            else:
-                threshold = 70
-            ratio = fuzz.ratio(new_diff, old_diff)
+        _, _, new_author, new_author_date, _, _ = new_commit
+        i = target_index["date"].get((new_author, new_author_date))
+        if i is not None:
+            return (i, None)
+
+    @staticmethod
+    def diff_threshold(diff):
+        """
+        The fuzz.ratio score a diff needs to beat to count as a match;
+        smaller diffs need to be closer to be considered the same change
+        """
+        if len(diff) <= 10:
+            return 90
+        elif len(diff) <= 50:
+            return 80
+        return 70
+
+    @timed('match_diff')
+    def match_diff(self, new_commit, target_index):
+        """
+        Fuzzy comparison of two diffs (changes only), scoring only the
+        target-only commits the DiffIndex deems capable of matching.
+        Returns (index of the matching commit, {"ratio": ratio}) on a match
+        """
+
+        new_diff = new_commit[5]
+        threshold = self.diff_threshold(new_diff)
+        for i in target_index["diff"].candidates(new_diff, threshold):
+            ratio = fuzz.ratio(new_diff, target_index["commits"][i][5])
             if ratio > threshold:
-                self.add_match("Diff match", project, old_author, old_sha,
-                               old_commit_message, new_sha, new_commit_message, {"ratio": ratio})
-                return ratio
+                return (i, {"ratio": ratio})
 
-    def match_summary(self, project, new_commit, old_commits):
+    @timed('match_summary')
+    def match_summary(self, new_commit, target_index):
         """
-        Matches the summary of a new commit with the summaries of old commits.
+        Matches the summary of a new commit with the summaries of the
+        indexed target-only commits, returning (index of the matching
+        commit, None) if found.
         """
-        new_sha, new_commit_message, _, _, _, _ = new_commit
-        for old_sha, old_commit_message, old_author, _, _, _ in old_commits:
-            normalized_old_commit_message = re.sub(self.backport_regex, '', re.sub(
-                self.normalize_regex, '', old_commit_message)).lower()
-            normalized_new_commit_message = re.sub(self.backport_regex, '', re.sub(
-                self.normalize_regex, '', new_commit_message)).lower()
-            if normalized_old_commit_message == normalized_new_commit_message and len(old_commit_message) > 10:
-                self.add_match("Summary match", project, old_author, old_sha,
-                               old_commit_message, new_sha, new_commit_message)
-                return True
+        i = target_index["summary"].get(self.normalize_summary(new_commit[1]))
+        if i is not None:
+            return (i, None)
 
     def get_ignored_commits(self):
         commits = []
@@ -859,82 +1553,332 @@ class MissingCommits:
                              f'not found.  Continuing...')
         return commits
 
-    def show_needed_commits(self, repo_path, change_info):
+    @timed('ticket_index')
+    def ticket_index(self, repo_path, target_sha):
+        """
+        Return a dict mapping ticket keys to the (short sha, subject) of
+        each commit reachable from target_sha which mentions them, newest
+        first. Each (project, target SHA) is only indexed once, and if
+        the SHA last indexed for the project is an ancestor of
+        target_sha only the commits in between are read
+        """
+
+        indexes = self.ticket_indexes.setdefault(repo_path, {})
+        if target_sha in indexes:
+            return indexes[target_sha]
+
+        sep = self.log_field_separator
+
+        def read_log(*revs):
+            # Boundary commits (marked "-") are the excluded commits
+            # which listed commits have as parents
+            try:
+                output = self.check_output(
+                    [self.git_bin, 'log', '--boundary',
+                     f'--format=%m%H{sep}%h{sep}%s', *revs],
+                    cwd=self.project_dir(repo_path), stderr=subprocess.STDOUT
+                ).decode(errors='replace')
+            except subprocess.CalledProcessError as exc:
+                traceback.print_exc()
+                raise RuntimeError(f'The "git log" command for project "{repo_path}" '
+                                   f'failed: {exc.stdout}') from exc
+
+            commits = []
+            boundary = set()
+            for line in output.splitlines():
+                long_sha, sha, subject = line[1:].split(sep, 2)
+                if line.startswith('-'):
+                    boundary.add(long_sha)
+                else:
+                    commits.append((sha, subject))
+            return commits, boundary
+
+        # The last SHA indexed is an ancestor of target_sha exactly when
+        # it's a boundary commit of the range between them; if it isn't,
+        # the range doesn't cover all of target_sha's history
+        base_sha = next(reversed(indexes), None)
+        if base_sha:
+            commits, boundary = read_log(target_sha, '--not', base_sha)
+            if base_sha not in boundary:
+                base_sha = None
+        if not base_sha:
+            commits, _ = read_log(target_sha)
+
+        index = {}
+        for sha, subject in commits:
+            for ticket in set(get_tickets(subject)):
+                index.setdefault(ticket, []).append((sha, subject))
+
+        # Commits from the ancestor's index are all older than the new ones
+        if base_sha:
+            for ticket, entries in indexes[base_sha].items():
+                index.setdefault(ticket, []).extend(entries)
+
+        indexes[target_sha] = index
+        return index
+
+    def is_ignored(self, sha):
+        """
+        Whether a commit is listed in the ignored commits file
+        """
+        return any(c.startswith(sha[:7]) for c in self.ignored_commits)
+
+    def skip_project(self, repo_path):
         """
-        Determine missing commits for a given project based on two commit
-        SHAs for the project. This is done by doing a 'git log' on the
-        symmetric difference of the two commits in forward and reversed order,
-        then comparing the summary content, dates and diffs from the latter to
-        find a matching entry in the former, which are all strong indications
-        that the commit was properly merged into the project at the time of the
-        target manifest.
-        Retrieve any possible matches along with any missing commits to
-        allow us to determine what might still need to be merged forward.
+        Whether a project should be left out of the check
         """
 
         # We skip any projects which:
         # - are explicitly ignored
         # - don't match the targeted project (if a project is being targeted)
         # - are third party godeps
-        if repo_path in self.ignore_projects or (
+        return repo_path in self.ignore_projects or (
             self.targeted_projects and not any(
                 re.search(rf'\b{project}\b', repo_path) for project in self.targeted_projects
             ) or (
                 repo_path.startswith(
                 "godeps") and "couchbase" not in repo_path
-            )):
-            return
+            ))
+
+    @timed('collect_commits', project=lambda repo_path, _: repo_path)
+    def collect_commits(self, repo_path, change_info):
+        """
+        Gather the commits which differ between a project's two SHAs, by
+        doing a 'git log' on the symmetric difference of the two commits
+        in forward and reversed order. Returns None if the project is
+        being skipped
+        """
+
+        if self.skip_project(repo_path):
+            return None
 
         source_sha, target_sha = change_info
-        missing_cmd_base = [
-            self.git_bin, 'log', '--oneline', '--cherry-pick',
-            '--right-only', '--no-merges'
-        ]
 
         source_sha = self.get_long_sha(repo_path, source_sha)
         target_sha = self.get_long_sha(repo_path, target_sha)
 
-        project_dir = self.product_dir / repo_path
+        return {
+            "repo_path": repo_path,
+            "project_name": self.get_project_name(repo_path),
+            "source_sha": source_sha,
+            "target_sha": target_sha,
+            # Commits that are in the target manifest but NOT in the
+            # source manifest
+            "target_only": self.get_range_commits(
+                repo_path, f'{source_sha}...{target_sha}'),
+            # Commits that are in the source manifest but NOT in the
+            # target manifest (These are the potentially missing commits
+            # we're checking for)
+            "source_only": self.get_range_commits(
+                repo_path, f'{target_sha}...{source_sha}'),
+        }
+
+    @timed('collect_commits', project=lambda repo_path, _: repo_path)
+    def collect_linear(self, repo_path, shas):
+        """
+        Linear-chain counterpart to collect_commits(). Given a project's
+        SHA in each manifest (None where a manifest doesn't include it),
+        walk its history once from all of them, noting which manifests
+        each commit is reachable from as a bitmask. The source-only and
+        target-only commits of every pair of manifests are then just set
+        operations on those masks, with patch IDs standing in for
+        '--cherry-pick'. Returns a list of ((i, j), commits) for each pair
+        of manifest indexes i < j in which the project changed, where
+        commits is what collect_commits() would return for that pair
+        """
 
-        # Commits that are in the target manifest but NOT in the source manifest
-        try:
-            target_only_results = self.check_output(
-                missing_cmd_base + [f'{source_sha}...{target_sha}'],
-                cwd=project_dir, stderr=subprocess.STDOUT
-            ).decode().strip()
-        except subprocess.CalledProcessError as exc:
-            traceback.print_exc()
-            raise RuntimeError(f'The "git log" command for project "{repo_path}" '
-                               f'failed: {exc.stdout}') from exc
+        if self.skip_project(repo_path):
+            return []
 
-        get_commit_details = functools.partial(
-            self.get_commit_details, repo_path=repo_path)
+        project_dir = self.project_dir(repo_path)
+        if not project_dir.is_dir():
+            self.log.warning(
+                f"Skipping {repo_path}, not present in the current checkout")
+            return []
 
-        target_only_commits = []
-        if target_only_results:
-            with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
-                target_only_commits = list(executor.map(
-                    get_commit_details, target_only_results.split("\n")))
+        long_shas = [
+            self.get_long_sha(repo_path, sha) if sha else None for sha in shas
+        ]
+        pairs = self.changed_pairs(long_shas)
+        if not pairs:
+            return []
 
-        # Commits that are in the source manifest but NOT in the target manifest
-        # (These are the potentially missing commits we're checking for)
+        tips = sorted(set(sha for sha in long_shas if sha))
         try:
-            source_only_results = self.check_output(
-                missing_cmd_base + [f'{target_sha}...{source_sha}'],
+            # Anything reachable from every tip is in every manifest, so
+            # there's no need to walk past the common ancestors
+            bases = self.check_output(
+                [self.git_bin, 'merge-base', '--all', '--octopus'] + tips,
                 cwd=project_dir, stderr=subprocess.STDOUT
-            ).decode().strip()
+            ).decode().split()
+        except subprocess.CalledProcessError as exc:
+            if exc.returncode != 1:
+                traceback.print_exc()
+                raise RuntimeError(f'The "git merge-base" command for project '
+                                   f'"{repo_path}" failed: {exc.stdout}') from exc
+            # Unrelated histories
+            bases = []
+
+        try:
+            # --date-order never shows a commit before its children, so
+            # by the time a commit is reached its mask is complete
+            output = self.check_output(
+                [self.git_bin, 'log', '--date-order', '--stdin',
+                 f'--format=%H{self.log_field_separator}%P'],
+                cwd=project_dir, stderr=subprocess.STDOUT,
+                input='\n'.join(tips + [f'^{base}' for base in bases]).encode()
+            ).decode()
         except subprocess.CalledProcessError as exc:
             traceback.print_exc()
             raise RuntimeError(f'The "git log" command for project "{repo_path}" '
                                f'failed: {exc.stdout}') from exc
 
-        source_only_commits = []
-        if source_only_results:
-            with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
-                source_only_commits = list(executor.map(
-                    get_commit_details, source_only_results.split("\n")))
-
+        reachable_from = defaultdict(int)
+        for i, sha in enumerate(long_shas):
+            if sha:
+                reachable_from[sha] |= 1 << i
+        present = sum(1 << i for i, sha in enumerate(long_shas) if sha)
+
+        walked = []
+        for line in output.splitlines():
+            sha, parents = line.split(self.log_field_separator)
+            parents = parents.split()
+            for parent in parents:
+                reachable_from[parent] |= reachable_from[sha]
+            # Merges are left out, as with 'git log --no-merges'
+            if len(parents) < 2 and reachable_from[sha] & present != present:
+                walked.append(sha)
+
+        details = dict(zip(walked, self.get_commits(
+            repo_path, ['--no-walk=unsorted', '--stdin'],
+            input='\n'.join(walked).encode())))
+        patch_ids = self.get_patch_ids(repo_path, walked)
         project_name = self.get_project_name(repo_path)
+
+        results = []
+        for i, j in pairs:
+            source = [
+                sha for sha in walked
+                if reachable_from[sha] >> i & 1 and not reachable_from[sha] >> j & 1
+            ]
+            target = [
+                sha for sha in walked
+                if reachable_from[sha] >> j & 1 and not reachable_from[sha] >> i & 1
+            ]
+            source_ids = set(patch_ids.get(sha) for sha in source)
+            target_ids = set(patch_ids.get(sha) for sha in target)
+            results.append(((i, j), {
+                "repo_path": repo_path,
+                "project_name": project_name,
+                "source_sha": long_shas[i],
+                "target_sha": long_shas[j],
+                "target_only": [
+                    details[sha] for sha in target
+                    if sha not in patch_ids or patch_ids[sha] not in source_ids
+                ],
+                "source_only": [
+                    details[sha] for sha in source
+                    if sha not in patch_ids or patch_ids[sha] not in target_ids
+                ],
+            }))
+        return results
+
+    @staticmethod
+    def changed_pairs(shas):
+        """
+        Return the pairs of manifest indexes i < j between which a project
+        with the given SHA in each manifest (None if it's not included)
+        has changed
+        """
+        return [
+            (i, j) for i, j in combinations(range(len(shas)), 2)
+            if shas[i] and shas[j] and shas[i] != shas[j]
+        ]
+
+    def classify_linear(self, project_pairs):
+        """
+        Run classify_commits() for each of the pairs returned by
+        collect_linear(), with the ignored commits of the pair's newer
+        manifest
+        """
+
+        outcomes = []
+        for (_, j), commits in project_pairs:
+            self.ignored_commits = self.linear_ignored_commits[j]
+            outcomes.append(self.classify_commits(commits))
+        return outcomes
+
+    @timed('classify_commits',
+           project=lambda project_commits: project_commits["repo_path"])
+    def classify_commits(self, project_commits):
+        """
+        Decide what to make of each of a project's source-only commits,
+        comparing the summary content, dates and diffs to find a matching
+        entry in the target-only commits, which are all strong indications
+        that the commit was properly merged into the project at the time
+        of the target manifest. Returns a list, in source-only order, of
+        (match type, details) where match type is one of:
+          - "Ignored": listed in the ignored commits file
+          - "Backport": details are the target commits carrying a ticket
+            this commit's ticket is a backport of
+          - one of the other match_types: details are (index of the
+            matching target-only commit, extra match info)
+          - None: no match found, the commit is missing
+        This only reads state, so it is safe to run in a worker process
+        """
+
+        repo_path = project_commits["repo_path"]
+        target_index = None
+        outcomes = []
+
+        for commit in project_commits["source_only"]:
+            sha, message = commit[0], commit[1]
+
+            if self.is_ignored(sha):
+                outcomes.append(("Ignored", None))
+                continue
+
+            backports = self.backports_of(get_tickets(message))
+            if backports:
+                index = self.ticket_index(repo_path, project_commits["target_sha"])
+                matches = {
+                    match_sha: match_message
+                    for backport in backports
+                    for match_sha, match_message in index.get(backport, [])
+                }
+                if matches:
+                    outcomes.append(("Backport", matches))
+                    continue
+
+            if target_index is None:
+                target_index = self.index_target_commits(
+                    project_commits["target_only"])
+
+            for match_type, matcher in (("Summary match", self.match_summary),
+                                        ("Date match", self.match_date),
+                                        ("Diff match", self.match_diff)):
+                match = matcher(commit, target_index)
+                if match:
+                    outcomes.append((match_type, match))
+                    break
+            else:
+                outcomes.append((None, None))
+
+        return outcomes
+
+    @timed('show_needed_commits',
+           project=lambda project_commits, _: project_commits["repo_path"])
+    def show_needed_commits(self, project_commits, outcomes):
+        """
+        Record the matches and missing commits for a given project, as
+        determined by classify_commits(), to allow us to determine what
+        might still need to be merged forward.
+        """
+
+        project_name = project_commits["project_name"]
+        target_only_commits = project_commits["target_only"]
+        source_only_commits = project_commits["source_only"]
+
         if project_name not in self.commits[self.product]:
             self.commits[self.product
                          ][project_name] = default_dict_factory()
@@ -943,12 +1887,10 @@ class MissingCommits:
 
         if source_only_commits:
             missing_commits_count = 0
-            for commit in source_only_commits:
+            for commit, (match_type, details) in zip(source_only_commits, outcomes):
                 sha, message, author, _, commit_date, _ = commit
 
-                if any(
-                    c.startswith(sha[:7]) for c in self.ignored_commits
-                ):
+                if match_type == "Ignored":
                     # Still update present_in to maintain cross-pair state.
                     # This pair proves the commit is present in old_manifest,
                     # which may resolve a missing_from entry left by an
@@ -957,36 +1899,18 @@ class MissingCommits:
                         self._mark_commit_status(project_name, sha, present_in=[self.old_manifest])
                     continue
 
-                backports = self.backports_of(get_tickets(message))
-                is_a_backport = False
-                if backports:
-                    gitlog = self.Popen(
-                        ['git', 'log', '--oneline', target_sha],
-                        cwd=project_dir,
-                        stdout=subprocess.PIPE)
-                    try:
-                        matches = self.check_output(
-                            ['grep', '-E'] + ['|'.join(backports)], stdin=gitlog.stdout
-                        ).decode("ascii").strip().split("\n")
-                        if len(matches) > 0:
-                            is_a_backport = True
-                    except subprocess.CalledProcessError as exc:
-                        if exc.returncode == 1:
-                            # grep most likely failed to find a match.
-                            pass
-                        else:
-                            self.log.warning(f"Exception: {exc.output}")
-
-                if is_a_backport:
+                if match_type == "Backport":
                     self.matched_commits += 1
-                    self.add_match("Backport", project_name, author, sha, message, sha, message, {"backports": {
-                        match.split(" ")[0]: match.split(" ", 1)[1] for match in matches
-                    }})
+                    self.add_match("Backport", project_name, author, sha, message, sha, message, {
+                        "backports": details
+                    })
                     continue
 
-                if (self.match_summary(project_name, commit, target_only_commits) or
-                        self.match_date(project_name, commit, target_only_commits) or
-                        self.match_diff(project_name, commit, target_only_commits)):
+                if match_type is not None:
+                    i, extra_info = details
+                    old_sha, old_commit_message, old_author, _, _, _ = target_only_commits[i]
+                    self.add_match(match_type, project_name, old_author, old_sha,
+                                   old_commit_message, sha, message, extra_info)
                     continue
 
                 if sha not in self.commits[self.product][project_name]["TrackedCommits"]:
@@ -1005,52 +1929,50 @@ class MissingCommits:
             self.log.info(
                 f"Missing commits for {project_name}: {missing_commits_count}")
 
+    @timed('notify_users')
     def notify_users(self, recipient=None):
         """
         Collate a list of changes per project per user, and notify via slack
         """
 
-        report = {}
+        manifest_url = (f"{self.manifest_repo.replace('ssh://git@', 'https://').rstrip('/')}"
+                        f"/blob/{self.manifest_branch}")
+        links = {}
 
+        def manifest_links(manifests):
+            for manifest in manifests:
+                if manifest not in links:
+                    links[manifest] = f"<{manifest_url}/{manifest}|{manifest}>"
+            return ", ".join(links[manifest] for manifest in manifests)
+
+        # Render each missing commit once, grouped by author and project
+        report = {}
         for product, product_info in self.commits.items():
             for project, commits in product_info.items():
                 for missing_commit, missing_commit_info in commits.get('TrackedCommits', {}).items():
-                    author = missing_commit_info['author']
-                    message = missing_commit_info['message']
-                    present_in = missing_commit_info['present_in']
-                    missing_from = missing_commit_info['missing_from']
-
-                    if not missing_from:
+                    if not missing_commit_info['missing_from']:
                         continue
 
-                    if author not in report:
-                        report[author] = {}
-                    if project not in report[author]:
-                        report[author][project] = {}
-                    if missing_commit not in report[author][project]:
-                        report[author][project][missing_commit] = {
-                            "message": message,
-                            "present_in": present_in,
-                            "missing_from": missing_from,
-                        }
-
-        for author in report:
+                    author = missing_commit_info['author']
+                    report.setdefault(author, {}).setdefault(project, []).append(
+                        f"    *{missing_commit_info['message']}* (<{commits['url']}/commit/{missing_commit}|{missing_commit}>)\n"
+                        f"         date: {missing_commit_info['date']}\n"
+                        f"         present: {manifest_links(missing_commit_info['present_in'])}\n"
+                        f"         missing: {manifest_links(missing_commit_info['missing_from'])}\n"
+                    )
+
+        deliveries = []
+        for author, projects in report.items():
             target_user = recipient if recipient else author
-            message_header = message_header_template.format(author=author, product=product)
-            message = ""
-            for project in report[author]:
-                message += f"\n  Project: {project}\n"
-                for commit in report[author][project]:
-                    present_links = ", ".join([f"<{self.manifest_repo.replace('ssh://git@', 'https://').rstrip('/')}/blob/{self.manifest_branch}/{manifest}|{manifest}>" for manifest in report[author][project][commit]["present_in"]])
-                    missing_links = ", ".join([f"<{self.manifest_repo.replace('ssh://git@', 'https://').rstrip('/')}/blob/{self.manifest_branch}/{manifest}|{manifest}>" for manifest in report[author][project][commit]["missing_from"]])
-                    message += f"    *{report[author][project][commit].get('message')}* (<{self.commits[product][project]['url']}/commit/{commit}|{commit}>)\n"
-                    message += f"         date: {self.commits[product][project]['TrackedCommits'][commit]['date']}\n"
-                    message += f"         present: {present_links}\n"
-                    message += f"         missing: {missing_links}\n"
+            message_header = message_header_template.format(author=author, product=self.product)
+            message = "".join(
+                f"\n  Project: {project}\n" + "".join(commit_messages)
+                for project, commit_messages in projects.items()
+            )
 
             if author.endswith("@couchbase.com"):
                 if self.notify:
-                    self.send_alert(target_user, message_header, message)
+                    deliveries.append((target_user, message_header, message))
                 else:
                     if target_user not in self.notified_users:
                         self.notified_users.append(target_user)
@@ -1058,6 +1980,24 @@ class MissingCommits:
                 if author not in self.skipped_users:
                     self.skipped_users.append(author)
 
+        if deliveries:
+            # Messages go out in parallel; the client waits out any
+            # rate limiting (see __init__)
+            user_ids = self.slack_user_ids(target for target, _, _ in deliveries)
+            start = time.perf_counter()
+            with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.notify_workers) as executor:
+                delivered = list(executor.map(
+                    lambda delivery: self.send_alert(
+                        *delivery, user=user_ids.get(delivery[0].lower())),
+                    deliveries))
+            self.log.info(f"Sent {len(deliveries)} Slack notifications in "
+                          f"{time.perf_counter() - start:.2f}s")
+
+            for (target_user, _, _), success in zip(deliveries, delivered):
+                if success and target_user not in self.notified_users:
+                    self.notified_users.append(target_user)
+
         # Show info about which users were emailed, and which were skipped
         if self.skipped_users:
             self.log.info(
@@ -1105,9 +2045,51 @@ def main():
     parser.add_argument('--compare_builds', action='store_true', default=False,
                         help='Compare two specific builds')
     parser.add_argument('--manifest_repo', help='Git URL to manifest repo')
+    parser.add_argument('--persistent_checkout', action='store_true',
+                        help='Keep and refresh one repo checkout for all '
+                             'manifest pairs rather than re-syncing each pair')
+    parser.add_argument('--checkout_dir',
+                        help='Path to the repo checkout (defaults to the '
+                             'product name in the current directory)')
+    parser.add_argument('--cache_file',
+                        help='Path to an SQLite cache of commit details to '
+                             'reuse between runs')
+    parser.add_argument('--cache_size', type=int, default=1024,
+                        help='Size in MB to trim the commit cache to at the '
+                             'end of a run (default: 1024)')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Number of projects to process in parallel '
+                             '(default: 1)')
+    parser.add_argument('--jira_cache_file',
+                        help='Path to a JSON cache of Jira backport links to '
+                             'reuse between runs')
+    parser.add_argument('--jira_cache_ttl', type=float, default=24,
+                        help='Hours before a cached Jira lookup is refreshed '
+                             '(default: 24)')
+    parser.add_argument('--linear', action='store_true',
+                        help='Sync each manifest once and walk each project\'s '
+                             'history once, rather than comparing every '
+                             'manifest pair separately (implies '
+                             '--persistent_checkout)')
+    parser.add_argument('--state_file',
+                        help='Path to a JSON file to save per-project results '
+                             'to, for use by --incremental')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Reuse the results saved in --state_file for '
+                             'projects whose SHAs haven\'t changed (implies '
+                             '--persistent_checkout)')
+    parser.add_argument('--timings_file',
+                        help='Path to write per-phase and per-project timings '
+                             'to, as JSON')
+    parser.add_argument('--profile',
+                        help='Path to write cProfile stats for the run to '
+                             '(covers the main process only)')
     parser.add_argument('product', help='Product to check')
     args = parser.parse_args()
 
+    if args.incremental and not args.state_file:
+        parser.error('--incremental requires --state_file')
+
     # Set up logging
     logger = logging.getLogger(__name__)
     logger.setLevel(logging.DEBUG)
@@ -1127,7 +2109,14 @@ def main():
         args.first_manifest, args.last_manifest,
         reporef_dir, args.targeted_projects, args.debug,
         args.show_matches, args.only_boundaries,
-        args.compare_builds, args.notify
+        args.compare_builds, args.notify,
+        persistent_checkout=(args.persistent_checkout or args.linear
+                             or args.incremental),
+        checkout_dir=args.checkout_dir,
+        cache_file=args.cache_file, cache_size=args.cache_size,
+        jira_cache_file=args.jira_cache_file,
+        jira_cache_ttl=args.jira_cache_ttl, jobs=args.jobs,
+        state_file=args.state_file, incremental=args.incremental
     )
 
     manifest_missing = False
@@ -1172,23 +2161,56 @@ def main():
 
     commit_checker.manifests = manifests
 
-    for a, b in combinations(commit_checker.manifests, 2):
+    profiler = None
+    if args.profile:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    start = time.time()
+
+    if args.linear:
         try:
-            commit_checker.identify_missing_commits(a, b)
+            commit_checker.identify_missing_commits_linear()
         except Exception:
             traceback.print_exc()
             sys.exit(1)
+    else:
+        for a, b in combinations(commit_checker.manifests, 2):
+            try:
+                commit_checker.identify_missing_commits(a, b)
+            except Exception:
+                traceback.print_exc()
+                sys.exit(1)
+
+    if commit_checker.commit_cache is not None:
+        evicted = commit_checker.commit_cache.evict()
+        if evicted:
+            logger.debug(f"Evicted {evicted} entries from the commit cache")
+        commit_checker.commit_cache.close()
+    commit_checker.ticket_cache.save()
+    if commit_checker.run_state is not None:
+        # Results for projects outside --project are kept for later runs
+        commit_checker.run_state.save(
+            combinations(commit_checker.manifests, 2),
+            partial=commit_checker.targeted_projects is not None)
 
     if commit_checker.matched_commits > 0:
         print(f"Matched {commit_checker.matched_commits} commits")
 
     print(commit_checker)
 
-    if commit_checker.total_missing > 0:
+    missing = commit_checker.total_missing
+    if missing > 0:
         commit_checker.notify_users(args.test_email)
-        sys.exit(1)
-    else:
-        sys.exit(0)
+
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+    if args.timings_file:
+        commit_checker.timings.write(
+            args.timings_file, product=args.product, manifests=manifests,
+            jobs=args.jobs, total_wall=time.time() - start)
+
+    sys.exit(1 if missing > 0 else 0)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,104 @@
+"""
+Parsed manifest cache for find_missing_commits. The same few manifests
+are looked up over and over (the project URL of every changed project,
+annotations for every manifest pair, the checkout's project map), so
+each file is parsed once into plain dicts and kept until it changes on
+disk.
+"""
+import hashlib
+import os
+import threading
+import time
+import xml.etree.ElementTree as ET
+
+
+class Manifest:
+    def __init__(self, root):
+        """
+        root: the <manifest> element of a parsed manifest
+        """
+
+        self.remotes = {
+            remote.get("name"): remote.get("fetch")
+            for remote in root.findall("remote")
+        }
+
+        default = root.find("default")
+        self.default_remote = default.get("remote") if default is not None else None
+        self.default_revision = default.get("revision") if default is not None else None
+
+        # name -> project details (the first project if a name repeats)
+        # and path -> project details
+        self.projects = {}
+        self.paths = {}
+        for element in root.findall("project"):
+            project = {
+                "name": element.get("name"),
+                "path": element.get("path") or element.get("name"),
+                "remote": element.get("remote") or self.default_remote,
+                "revision": element.get("revision") or self.default_revision,
+            }
+            self.projects.setdefault(project["name"], project)
+            self.paths[project["path"]] = project
+
+        # name -> browsable URL, None if the project's remote is unknown
+        self.project_urls = {}
+        for name, project in self.projects.items():
+            fetch_url = self.remotes.get(project["remote"])
+            self.project_urls[name] = None if fetch_url is None else (
+                f"{fetch_url.rstrip('/')}/{name}".replace("ssh://git@", "https://"))
+
+        # Annotations on the build project. An element without children
+        # is falsy, and callers have always treated a build project with
+        # no children as having no annotations
+        self.annotations = {}
+        build = root.find("project[@name='build']")
+        if build is not None and len(build):
+            for annotation in build.findall("annotation"):
+                self.annotations.setdefault(
+                    annotation.get("name"), annotation.get("value"))
+
+
+class _Entry:
+    def __init__(self, stat, digest, manifest):
+        self.stat = stat
+        self.digest = digest
+        self.manifest = manifest
+        self.checked = time.time()
+
+
+_cache = {}
+_lock = threading.Lock()
+
+
+def load_manifest(path):
+    """
+    Return the Manifest for a file, only parsing it if it hasn't been
+    loaded before or its contents have changed. An unchanged size and
+    mtime is trusted unless the file was modified too close to when it
+    was last read for the mtime to tell, in which case the contents are
+    hashed and compared instead
+    """
+
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    stat = (st.st_mtime_ns, st.st_size)
+
+    with _lock:
+        entry = _cache.get(path)
+    if (entry is not None and entry.stat == stat
+            and st.st_mtime < entry.checked - 1):
+        return entry.manifest
+
+    with open(path, "rb") as fh:
+        data = fh.read()
+    digest = hashlib.sha1(data).hexdigest()
+
+    if entry is not None and entry.digest == digest:
+        manifest = entry.manifest
+    else:
+        manifest = Manifest(ET.fromstring(data))
+
+    with _lock:
+        _cache[path] = _Entry(stat, digest, manifest)
+    return manifest
@@ -0,0 +1,92 @@
+"""
+State kept between find_missing_commits runs for --incremental. For each
+manifest pair and project, this records the SHAs that were compared and
+everything needed to record the result again without redoing the
+comparison: the commits (minus their diffs) and how each was
+classified, along with the inputs the classification depended on
+besides the SHAs (the ignored commits and Jira backport links).
+"""
+import json
+import os
+import pathlib
+import threading
+
+
+class RunState:
+    # Bumped whenever the stored format or the meaning of a stored result
+    # changes, so results from an older version are never reused
+    version = 1
+
+    def __init__(self, path):
+        """
+        path: JSON file to load from and save to
+        """
+
+        self.path = pathlib.Path(path)
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.used = {}
+
+        if self.path.exists():
+            try:
+                with open(self.path) as fh:
+                    state = json.load(fh)
+                if state.get("version") == self.version:
+                    self.entries = state["entries"]
+            except (OSError, ValueError, KeyError):
+                # A corrupt state file just means a full run
+                self.entries = {}
+
+    @staticmethod
+    def key(old_manifest, new_manifest, repo_path):
+        return f"{old_manifest}\n{new_manifest}\n{repo_path}"
+
+    def get(self, old_manifest, new_manifest, repo_path):
+        """
+        Return the stored entry for a project in a manifest pair, or None
+        """
+
+        with self.lock:
+            return self.entries.get(
+                self.key(old_manifest, new_manifest, repo_path))
+
+    def keep(self, old_manifest, new_manifest, repo_path):
+        """
+        Mark a stored entry as still in use, so save() holds on to it
+        """
+
+        key = self.key(old_manifest, new_manifest, repo_path)
+        with self.lock:
+            self.used[key] = self.entries[key]
+
+    def put(self, old_manifest, new_manifest, repo_path, entry):
+        key = self.key(old_manifest, new_manifest, repo_path)
+        with self.lock:
+            self.entries[key] = entry
+            self.used[key] = entry
+
+    def save(self, pairs, partial=False):
+        """
+        Write out the entries for the (old manifest, new manifest) pairs
+        this run compared: those it used or produced, plus for a partial
+        run (one which only looked at some projects) the earlier entries
+        for the projects it didn't look at. Entries for other pairs relate
+        to manifests which are no longer compared
+        """
+
+        pairs = set(self.key(old_manifest, new_manifest, "")
+                    for old_manifest, new_manifest in pairs)
+        with self.lock:
+            entries = {}
+            if partial:
+                entries = {
+                    key: entry for key, entry in self.entries.items()
+                    if key[:key.rindex("\n") + 1] in pairs
+                }
+            entries.update(self.used)
+            state = {"version": self.version, "entries": entries}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "w") as fh:
+            json.dump(state, fh)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,78 @@
+"""
+Cache of Jira "is a backport of" links for find_missing_commits. The same
+tickets come up for every manifest pair and on every nightly run, so
+lookups are memoized in memory and optionally persisted to a JSON file,
+with entries expiring after a configurable time so new links are noticed.
+"""
+import json
+import os
+import pathlib
+import threading
+import time
+
+
+class TicketCache:
+    def __init__(self, path=None, ttl=24 * 60 * 60):
+        """
+        path: JSON file to load from and save to (None for memory only)
+        ttl: seconds after which an entry is considered stale
+        """
+
+        self.path = pathlib.Path(path) if path is not None else None
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = {}
+
+        if self.path is not None and self.path.exists():
+            try:
+                with open(self.path) as fh:
+                    self.entries = json.load(fh)
+            except (OSError, ValueError):
+                # A corrupt cache just means fetching everything again
+                self.entries = {}
+
+    def get(self, ticket):
+        """
+        Return the cached list of backported ticket keys for a ticket, or
+        None if it isn't cached (or the entry has expired)
+        """
+
+        with self.lock:
+            entry = self.entries.get(ticket)
+        if entry is None or time.time() - entry["fetched"] > self.ttl:
+            return None
+        return entry["backports"]
+
+    def put(self, ticket, backports):
+        with self.lock:
+            self.entries[ticket] = {
+                "backports": list(backports),
+                "fetched": time.time(),
+            }
+
+    def missing(self, tickets):
+        """
+        Return the (sorted, de-duplicated) tickets needing a Jira lookup
+        """
+        return sorted(
+            ticket for ticket in set(tickets) if self.get(ticket) is None)
+
+    def save(self):
+        """
+        Write unexpired entries back to disk
+        """
+
+        if self.path is None:
+            return
+
+        now = time.time()
+        with self.lock:
+            entries = {
+                ticket: entry for ticket, entry in self.entries.items()
+                if now - entry["fetched"] <= self.ttl
+            }
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "w") as fh:
+            json.dump(entries, fh)
+        os.replace(tmp_path, self.path)
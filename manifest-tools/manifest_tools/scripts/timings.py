@@ -0,0 +1,138 @@
+"""
+Per-phase timing for find_missing_commits, to show where a run's time
+goes (syncing, git, Jira, matching...) and to spot regressions between
+runs. Each phase records its number of calls, wall time and the number
+of subprocesses started while it was running, both overall and for the
+project being worked on at the time. Phases can nest, and times and
+counts are inclusive of any nested phases.
+"""
+import functools
+import json
+import os
+import pathlib
+import time
+
+from collections import defaultdict
+from contextlib import contextmanager
+
+
+def _new_stats():
+    return {"calls": 0, "wall": 0.0, "subprocesses": 0}
+
+
+class PhaseTimer:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.phases = defaultdict(_new_stats)
+        self.projects = defaultdict(lambda: defaultdict(_new_stats))
+        self.active = []
+        self.current_project = None
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Time the enclosed code as the named phase
+        """
+
+        # A phase re-entered from within itself is only counted once
+        if name in self.active:
+            yield
+            return
+
+        project = self.current_project
+        self.active.append(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.active.remove(name)
+            for stats in self._stats(name, project):
+                stats["calls"] += 1
+                stats["wall"] += elapsed
+
+    @contextmanager
+    def project(self, repo_path):
+        """
+        Attribute phases in the enclosed code to a project
+        """
+
+        previous = self.current_project
+        self.current_project = repo_path
+        try:
+            yield
+        finally:
+            self.current_project = previous
+
+    def subprocess(self):
+        """
+        Note that a subprocess is being started
+        """
+        for name in self.active:
+            for stats in self._stats(name, self.current_project):
+                stats["subprocesses"] += 1
+
+    def _stats(self, name, project):
+        yield self.phases[name]
+        if project is not None:
+            yield self.projects[project][name]
+
+    def as_dict(self):
+        return {
+            "phases": {name: dict(stats) for name, stats in self.phases.items()},
+            "projects": {
+                project: {name: dict(stats) for name, stats in phases.items()}
+                for project, phases in self.projects.items()
+            },
+        }
+
+    def merge(self, timings):
+        """
+        Add in the output of another timer's as_dict(), e.g. from a
+        worker process
+        """
+
+        def add(total, stats):
+            for key, value in stats.items():
+                total[key] += value
+
+        for name, stats in timings["phases"].items():
+            add(self.phases[name], stats)
+        for project, phases in timings["projects"].items():
+            for name, stats in phases.items():
+                add(self.projects[project][name], stats)
+
+    def write(self, path, **extra):
+        """
+        Write the timings, plus any extra top-level fields, as JSON
+        """
+
+        path = pathlib.Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "w") as fh:
+            json.dump(dict(extra, **self.as_dict()), fh, indent=2, sort_keys=True)
+        os.replace(tmp_path, path)
+
+
+def timed(name, project=None):
+    """
+    Decorator timing a method as the named phase, using the instance's
+    'timings' PhaseTimer. project, if given, is called with the method's
+    arguments to find the project the call (and any phases within it)
+    should be attributed to
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            if project is None:
+                with self.timings.phase(name):
+                    return func(self, *args, **kwargs)
+            with self.timings.project(project(*args, **kwargs)), \
+                    self.timings.phase(name):
+                return func(self, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,192 @@
+"""
+Check that find_missing_commits' linear mode finds the same missing
+commits as comparing each pair of manifests, including for a project
+which has been dropped from the newest manifest, so the final checkout
+no longer has a working tree for it.
+
+Run with pytest from the manifest-tools directory:
+    python -m pytest tests
+"""
+import json
+import logging
+import os
+import shutil
+import subprocess
+import types
+
+from itertools import combinations
+
+import pytest
+
+import manifest_tools.scripts.find_missing_commits as find_missing_commits
+from manifest_tools.scripts.manifest_model import load_manifest
+
+
+PRODUCT = 'product'
+RELEASES = ['release-0', 'release-1', 'release-2']
+
+
+class FakeJira:
+    """
+    Jira with no "is a backport of" links
+    """
+
+    def issue(self, key):
+        return types.SimpleNamespace(
+            key=key, raw={"fields": {"issuelinks": []}})
+
+    def search_issues(self, jql, **kwargs):
+        keys = jql[jql.index('(') + 1:jql.rindex(')')].split(',')
+        return [self.issue(key) for key in keys]
+
+
+def git(git_dir, *args, input=None, date=1600000000):
+    return subprocess.run(
+        ['git', '--git-dir', str(git_dir)] + list(args), input=input,
+        stdout=subprocess.PIPE, check=True,
+        env=dict(os.environ, GIT_AUTHOR_NAME='dev', GIT_AUTHOR_EMAIL='dev@example.com',
+                 GIT_COMMITTER_NAME='dev', GIT_COMMITTER_EMAIL='dev@example.com',
+                 GIT_AUTHOR_DATE=f'{date} +0000',
+                 GIT_COMMITTER_DATE=f'{date} +0000')
+    ).stdout.decode().strip()
+
+
+def commit(git_dir, parent, files, message, date):
+    """
+    Commit files (name -> content) on top of parent, returning the SHA
+    """
+
+    tree = git(git_dir, 'mktree', input=''.join(
+        f'100644 blob {git(git_dir, "hash-object", "-w", "--stdin", input=content.encode())}'
+        f'\t{name}\n'
+        for name, content in sorted(files.items())
+    ).encode())
+    args = ['commit-tree', tree, '-m', message]
+    if parent is not None:
+        args += ['-p', parent]
+    return git(git_dir, *args, date=date)
+
+
+def build_project(checkout, project):
+    """
+    Create a project's git directory where repo keeps it, with a branch
+    per release: release-0 has a fix which release-1 is missing, and
+    release-2 has both
+    """
+
+    git_dir = checkout / '.repo' / 'projects' / f'{project}.git'
+    subprocess.run(['git', 'init', '-q', '--bare', str(git_dir)], check=True)
+    git(git_dir, 'config', 'core.bare', 'false')
+
+    files = {'README': f'{project}\n'}
+    base = commit(git_dir, None, files, 'Initial import', 1600000000)
+    fix = commit(git_dir, base, dict(files, fix='fix\n'),
+                 f'MB-100 Fix crash in {project}', 1600000100)
+    feature = commit(git_dir, base, dict(files, feature='feature\n'),
+                     f'MB-200 Add new {project} option', 1600000200)
+    both = commit(git_dir, feature, dict(files, fix='fix\n', feature='feature\n'),
+                  f'MB-100 Fix crash in {project}', 1600000100)
+    for release, sha in zip(RELEASES, [fix, feature, both]):
+        git(git_dir, 'update-ref', f'refs/remotes/origin/{release}', sha)
+
+
+class RepoMissingCommits(find_missing_commits.MissingCommits):
+    """
+    MissingCommits with 'repo sync' done in-process: projects in the
+    manifest get a working tree linked to their git directory, and
+    projects which aren't lose theirs, as with repo
+    """
+
+    def repo_sync(self):
+        manifest = load_manifest(self.manifest_dir / self.new_manifest)
+        projects_dir = self.product_dir / '.repo' / 'projects'
+        for git_dir in projects_dir.iterdir():
+            work_tree = self.product_dir / git_dir.name[:-len('.git')]
+            if work_tree.name in manifest.paths:
+                work_tree.mkdir(exist_ok=True)
+                (work_tree / '.git').write_text(f'gitdir: {git_dir.resolve()}\n')
+            elif work_tree.exists():
+                shutil.rmtree(work_tree)
+
+        with open('new.xml', 'w') as fh:
+            fh.write(
+                '<manifest>\n'
+                '  <remote name="origin" fetch="https://git.example.com/"/>\n'
+                + ''.join(
+                    f'  <project name="{project["name"]}" path="{path}" '
+                    f'remote="origin" revision="'
+                    + self.resolve_ref(path, f'refs/remotes/origin/{project["revision"]}')
+                    + '"/>\n'
+                    for path, project in manifest.paths.items())
+                + '</manifest>\n')
+
+    def diff_manifests(self):
+        old = load_manifest(self.manifest_dir / self.old_manifest).paths
+        new = load_manifest('new.xml').paths
+        return [
+            f'C {path} {old[path]["revision"]} {new[path]["revision"]}'
+            for path in sorted(set(old) & set(new))
+            if self.get_long_sha(path, old[path]["revision"]) != new[path]["revision"]
+        ]
+
+    def get_ignored_commits(self):
+        return []
+
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    checkout = tmp_path / PRODUCT
+    manifest_dir = tmp_path / 'manifests'
+    (manifest_dir / PRODUCT).mkdir(parents=True)
+    for project in ('kept', 'dropped'):
+        build_project(checkout, project)
+
+    # The newest manifest no longer includes 'dropped'
+    for release in RELEASES:
+        projects = ['kept'] if release == RELEASES[-1] else ['dropped', 'kept']
+        with open(manifest_dir / PRODUCT / f'{release}.xml', 'w') as fh:
+            fh.write(
+                '<manifest>\n'
+                '  <remote name="origin" fetch="https://git.example.com/"/>\n'
+                f'  <default remote="origin" revision="{release}"/>\n'
+                + ''.join(f'  <project name="{project}" path="{project}"/>\n'
+                          for project in projects)
+                + '</manifest>\n')
+    with open(manifest_dir / PRODUCT / 'product-config.json', 'w') as fh:
+        json.dump({"manifests": {
+            f'{PRODUCT}/{release}.xml': {} for release in reversed(RELEASES)}}, fh)
+
+    # project_url() looks for the manifests under the checkout
+    (checkout / '.repo' / 'manifests').symlink_to(manifest_dir.resolve())
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(find_missing_commits, 'connect_jira', FakeJira)
+    return manifest_dir
+
+
+def run_checker(manifest_dir, linear):
+    logger = logging.getLogger('test_linear_mode')
+    checker = RepoMissingCommits(
+        logger, PRODUCT, manifest_dir, 'https://git.example.com/manifest',
+        None, None, None, None, False, True, False, False, False,
+        persistent_checkout=True)
+    if linear:
+        checker.identify_missing_commits_linear()
+    else:
+        for old_manifest, new_manifest in combinations(checker.manifests, 2):
+            checker.identify_missing_commits(old_manifest, new_manifest)
+    return checker
+
+
+def test_dropped_project(workspace):
+    pairwise = run_checker(workspace, linear=False)
+    linear = run_checker(workspace, linear=True)
+
+    assert not (pairwise.product_dir / 'dropped').exists()
+    tracked = pairwise.commits[PRODUCT]['dropped']['TrackedCommits']
+    assert [commit['message'] for commit in tracked.values()] == \
+        ['MB-100 Fix crash in dropped']
+
+    assert json.loads(json.dumps(linear.commits)) == \
+        json.loads(json.dumps(pairwise.commits))
+    assert linear.total_missing == pairwise.total_missing
@@ -3,8 +3,10 @@
 import argparse
 import base64
 import html
+import json
 import os
 import re
+import subprocess
 import sys
 import urllib
 
@@ -14,7 +16,9 @@ script_dir = os.path.dirname(os.path.abspath(__file__))
 build_from_manifest_path = os.path.abspath(os.path.join(script_dir, "..", "build-from-manifest"))
 if build_from_manifest_path not in sys.path:
     sys.path.insert(0, build_from_manifest_path)
-from manifest_util import scan_manifests
+from manifest_util import (
+    get_metadata_for_manifest, get_metadata_for_products, sync_manifest_repo
+)
 
 """
 Intended to run as a Gerrit trigger or github action.
@@ -41,6 +45,10 @@ OUTPUT = {}
 # Name for output HTML file
 html_filename = "restricted.html"
 
+# Version of the on-disk branch index (see load_branch_index()); bumped
+# whenever its format or contents change
+BRANCH_INDEX_VERSION = 3
+
 
 def sanitize_for_template(value):
     """
@@ -122,34 +130,119 @@ def setup_environment():
     OUTPUT.update(globals())
 
 
-def check_branch_in_manifest(meta):
+def manifest_branches(manifest_et):
     """
-    Returns true if the PRODUCT/BRANCH are listed in the named manifest
+    Returns a dict of project name -> branch for every project in a
+    manifest (falling back to extend-project for names with no project)
     """
-    print(f"Checking manifest {meta['manifest_path']}")
-
-    manifest_et = meta["_manifest"]
-    project_et = manifest_et.find("./project[@name='{}']".format(PROJECT))
-    if project_et is None:
-        project_et = manifest_et.find("./extend-project[@name='{}']".format(PROJECT))
-        if project_et is None:
-            print("project {} not found".format(PROJECT))
-            return False
-
     # Compute the default branch for the manifest
     default_branch = "master"
     default_et = manifest_et.find("./default")
     if default_et is not None:
         default_branch = default_et.get("branch", "master")
 
-    # Pull out the branch for the given project
-    project_branch = project_et.get("revision", default_branch)
-    if project_branch != BRANCH:
-        print("project {} on branch {}, not {}".format(
-            PROJECT, project_branch, BRANCH)
+    # The first element for a name is the one that counts
+    branches = {}
+    for project_et in manifest_et.findall("./project"):
+        branches.setdefault(
+            project_et.get("name"), project_et.get("revision", default_branch)
         )
-        return False
-    return True
+    extended = {}
+    for project_et in manifest_et.findall("./extend-project"):
+        extended.setdefault(
+            project_et.get("name"), project_et.get("revision", default_branch)
+        )
+    for name, branch in extended.items():
+        branches.setdefault(name, branch)
+    return branches
+
+
+def build_branch_index(manifests):
+    """
+    Returns a dict with a reverse index ("branches") of "project\nbranch"
+    -> the restricted manifests (with an approval ticket) which have that
+    project on that branch, in manifest order, plus the restricted
+    manifests with no approval ticket ("unapproved"). Each manifest's
+    entry has what's needed to decide whether to check a change against
+    it; the rest of its metadata is only loaded for the manifests which
+    are checked
+    """
+    branches = {}
+    unapproved = []
+    for manifest, meta in manifests.items():
+        if not meta.get("restricted"):
+            continue
+        if meta.get("approval_ticket") is None:
+            unapproved.append(manifest)
+            continue
+
+        entry = {
+            "manifest": manifest,
+            "product_path": meta["product_path"],
+            "parent": meta.get("parent"),
+            "unrestricted_projects": meta.get("unrestricted_projects", []),
+        }
+        for project, branch in manifest_branches(meta["_manifest"]).items():
+            branches.setdefault(f"{project}\n{branch}", []).append(entry)
+    return {"branches": branches, "unapproved": unapproved}
+
+
+def manifest_commit(manifest_dir):
+    """
+    Returns the commit checked out in a manifest repository, or None if
+    that isn't known or the checkout has local changes
+    """
+    try:
+        commit = subprocess.check_output(
+            ["git", "-C", manifest_dir, "rev-parse", "HEAD"],
+            stderr=subprocess.DEVNULL
+        ).decode().strip()
+        changes = subprocess.check_output(
+            ["git", "-C", manifest_dir, "status", "--porcelain",
+             "--untracked-files=no"],
+            stderr=subprocess.DEVNULL
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return None if changes else commit
+
+
+def load_branch_index(manifest_dir):
+    """
+    Returns the branch index (see build_branch_index()) for a manifest
+    checkout, reusing the one saved in its .git directory if it was
+    built from the same commit, and otherwise scanning the manifests to
+    build (and save) it
+    """
+    commit = manifest_commit(manifest_dir)
+    index_file = os.path.join(manifest_dir, ".git", "restricted-branch-index.json")
+
+    if commit is not None and os.path.exists(index_file):
+        try:
+            with open(index_file) as fh:
+                saved = json.load(fh)
+            if (saved.get("version") == BRANCH_INDEX_VERSION
+                    and saved.get("commit") == commit):
+                print(f"Using branch index for manifest commit {commit}")
+                return saved["index"]
+        except (OSError, ValueError, KeyError):
+            # Rebuilt below
+            pass
+
+    print("Building branch index for restricted manifests")
+    index = build_branch_index(get_metadata_for_products(manifest_dir))
+
+    if commit is not None and os.path.isdir(os.path.dirname(index_file)):
+        tmp_file = f"{index_file}.{os.getpid()}.tmp"
+        with open(tmp_file, "w") as fh:
+            json.dump({
+                "version": BRANCH_INDEX_VERSION,
+                "commit": commit,
+                "index": index,
+            }, fh)
+        os.replace(tmp_file, index_file)
+
+    return index
 
 
 def can_bypass_restriction(ticket, jira):
@@ -461,33 +554,30 @@ def real_main():
         os.remove(html_filename)
 
     # Collect all restricted manifests that reference this branch
-    manifests = scan_manifests(manifest_project)
+    manifest_dir = sync_manifest_repo(manifest_project)
+    branch_index = load_branch_index(manifest_dir)
+    for manifest in branch_index["unapproved"]:
+        print("no approval ticket for restricted manifest {}".format(
+            manifest
+        ))
+
     restricted_manifests = []
-    for manifest in manifests:
-        meta = manifests[manifest]
-        if meta.get("restricted"):
-            approval_ticket = meta.get("approval_ticket")
-            if approval_ticket is None:
-                print("no approval ticket for restricted manifest {}".format(
-                    manifest
-                ))
-                continue
-
-            # Also see if projects are specifically excluded from check for this manifest
-            unrestricted_projects = meta.get("unrestricted_projects", [])
-            if PROJECT in unrestricted_projects:
-                print("Project {} is unrestricted in manifest {}".format(
-                    PROJECT, manifest
-                ))
-                continue
-
-            if not check_branch_in_manifest(meta):
-                continue
-
-            # Ok, this proposal is to a branch in a restricted manifest
-            restricted_manifests.append(manifest)
-            print("Project: {} Branch: {} is in restricted manifest: "
-                  "{}".format(PROJECT, BRANCH, manifest))
+    entries = {}
+    for entry in branch_index["branches"].get(f"{PROJECT}\n{BRANCH}", []):
+        manifest = entry["manifest"]
+        entries[manifest] = entry
+
+        # Also see if projects are specifically excluded from check for this manifest
+        if PROJECT in entry["unrestricted_projects"]:
+            print("Project {} is unrestricted in manifest {}".format(
+                PROJECT, manifest
+            ))
+            continue
+
+        # Ok, this proposal is to a branch in a restricted manifest
+        restricted_manifests.append(manifest)
+        print("Project: {} Branch: {} is in restricted manifest: "
+              "{}".format(PROJECT, BRANCH, manifest))
 
     # Now *remove* any restricted manifests that are the parent of any other
     # restricted manifests in the list. Logic: if a change is approved for a
@@ -497,7 +587,7 @@ def real_main():
     restricted_children = list(restricted_manifests)
     for manifest in restricted_manifests:
         print("....looking at {}".format(manifest))
-        parent = manifests[manifest].get("parent")
+        parent = entries[manifest]["parent"]
         print("....parent is {}".format(parent))
         if parent in restricted_children:
             print("Not checking manifest {} because it is a parent "
@@ -507,9 +597,14 @@ def real_main():
     # Now, iterate through all restricted manifests that we have left,
     # and ensure this ticket is approved for each.
     for manifest in restricted_children:
-        if not validate_change_in_ticket(manifests[manifest]):
+        # Load it from the product-config.json the index was built
+        # from, which needn't be the nearest one above the manifest
+        meta = get_metadata_for_manifest(
+            manifest_dir, manifest, entries[manifest]["product_path"]
+        )
+        if not validate_change_in_ticket(meta):
             OUTPUT["MANIFEST"] = manifest
-            output_report(manifests[manifest])
+            output_report(meta)
 
     # If we get here, the change is allowed!
     # Output "all clear" message if no restricted branches were checked,